@@ -0,0 +1,129 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .cache import reference_cache
+from .fetch import fetch_source
+from .ingest import MemoryPeak, clear_table, load_frame
+from .loaders import KEYED_MODES, UPLOAD_ENGINE
+from .metrics import upload_phase, upload_rows
+from .models import db, Department, Job, Employee
+from .utils import (
+    csv_kind,
+    get_null_ids,
+    pluralize,
+    process_csv_employee,
+    read_csv_file,
+    source_path,
+)
+from .watermarks import file_version, save_watermark
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# employees are transformed with the "not known" ids the other two loads create
+DEPENDENCIES = {"hired_employees": ("departments", "jobs")}
+BATCH_MODES = ("insert", "upsert", "replace")
+
+
+def load_order(kinds):
+    # loaded one after the other in the single transaction of the batch, files
+    # whose dependencies are in the batch go after them
+    return sorted(
+        kinds, key=lambda kind: bool(set(DEPENDENCIES.get(kind, ())) & set(kinds))
+    )
+
+
+def parse_file(file_value, source, keyed):
+    start = time.perf_counter()
+    file_path = source_path(file_value, source)
+    version = file_version(file_path) if keyed else None
+    local_path = fetch_source(file_path)
+    with upload_phase("read"):
+        df = read_csv_file(local_path, file_value)
+    if csv_kind(file_value) != "hired_employees":
+        df.loc[len(df)] = [-1, "not known"]
+    return {
+        "file_path": file_path,
+        "local_path": local_path,
+        "version": version,
+        "df": df,
+        "read_seconds": time.perf_counter() - start,
+    }
+
+
+def delete_replaced(kinds):
+    # children first so foreign keys never point to deleted rows
+    models = [pluralize(kind) for kind in kinds]
+    for model in (Employee, Job, Department):
+        if model in models:
+            clear_table(model)
+
+
+def load_file(kind, file, engine, mode):
+    model = pluralize(kind)
+    load_start = time.perf_counter()
+    df = file["df"]
+    if model == Employee:
+        with upload_phase("transform"):
+            # read in this transaction, the ids are not committed yet
+            df = process_csv_employee(df, get_null_ids())
+    used_engine = load_frame(model, df, engine, mode)
+    if mode in KEYED_MODES:
+        version, size = file["version"]
+        save_watermark(
+            file["file_path"], file["local_path"], version, size, len(df), mode
+        )
+    return {
+        "engine": used_engine,
+        "rows": len(df),
+        "read_seconds": round(file["read_seconds"], 3),
+        "load_seconds": round(time.perf_counter() - load_start, 3),
+    }
+
+
+def upload_batch(files, engine=UPLOAD_ENGINE, mode="insert"):
+    keyed = mode in KEYED_MODES
+    kinds = {csv_kind(file_value): (file_value, source) for file_value, source in files}
+    results = {}
+    start = time.perf_counter()
+    memory = MemoryPeak()
+
+    # every file is fetched and parsed once, all of them at the same time
+    with ThreadPoolExecutor(max_workers=len(files)) as pool:
+        parsed = {
+            kind: pool.submit(parse_file, file_value, source, keyed)
+            for kind, (file_value, source) in kinds.items()
+        }
+        parsed = {kind: future.result() for kind, future in parsed.items()}
+    memory.sample()
+
+    try:
+        if mode == "replace":
+            delete_replaced(kinds)
+        for kind in load_order(list(kinds)):
+            results[kind] = {
+                "file": kinds[kind][0],
+                **load_file(kind, parsed[kind], engine, mode),
+            }
+        # all files or none of them
+        with upload_phase("commit"):
+            db.session.commit()
+    finally:
+        reference_cache.invalidate()
+
+    for kind, result in results.items():
+        upload_rows.inc(result["rows"], table=pluralize(kind).__tablename__)
+    elapsed = time.perf_counter() - start
+    rows = sum(result["rows"] for result in results.values())
+
+    logger.info("Batch of %s files uploaded successfully", len(files))
+    return {
+        "message": f"{len(files)} files uploaded successfully",
+        "mode": mode,
+        "files": list(results.values()),
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed else None,
+        "peak_memory_mb": memory.mb(),
+    }
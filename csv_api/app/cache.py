@@ -0,0 +1,278 @@
+import abc
+import functools
+import hashlib
+import importlib
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import Response, g, has_request_context, jsonify, make_response, request
+from sqlalchemy import event, select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from . import coalesce
+from .coalesce import QueryLimitExceeded
+from .loaders import dialect_insert
+from .models import db, DataVersion
+from .replicas import RoutingSession, current_replica
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+REFDATA_CACHE_TTL = float(os.getenv("REFDATA_CACHE_TTL", "300"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+# "package.module:factory" returning a CacheBackend shared by all workers
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND")
+# seconds a response read from a replica is cached; the replica may lag behind the
+# data version read from the primary
+REPLICA_CACHE_TTL = float(os.getenv("REPLICA_CACHE_TTL", "5"))
+
+
+class TTLCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader, cache_if=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = loader()
+        if cache_if is None or cache_if(value):
+            with self._lock:
+                self._entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "ttl": self.ttl,
+            }
+
+
+reference_cache = TTLCache(REFDATA_CACHE_TTL)
+
+
+class CacheBackend(abc.ABC):
+    # storage for the cached responses; a shared implementation (e.g. redis)
+    # lets every worker reuse the same entries
+    @abc.abstractmethod
+    def get(self, key):
+        pass
+
+    @abc.abstractmethod
+    def set(self, key, value, ttl=None):
+        pass
+
+    @abc.abstractmethod
+    def clear(self):
+        pass
+
+
+class LRUBackend(CacheBackend):
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def load_backend(path):
+    module_name, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def data_version(self):
+        # kept in the database so every worker and process sees the other's writes
+        return db.session.execute(select(DataVersion.version)).scalar()
+
+    def bump_version(self):
+        # a random value instead of a counter: /recreate_tables drops the table and
+        # a counter starting over would reuse the keys of older entries
+        version = uuid.uuid4().hex
+        # an upsert, two processes finding the row missing must not both insert it
+        statement = dialect_insert(DataVersion.__table__).values(id=1, version=version)
+        statement = statement.on_conflict_do_update(
+            index_elements=["id"], set_={"version": statement.excluded.version}
+        )
+        db.session.execute(statement)
+        db.session.commit()
+        return version
+
+    def key(self, database, endpoint, args):
+        params = "&".join(f"{k}={v}" for k, v in sorted(args.items(multi=True)))
+        version = self.data_version()
+        return f"{database}|{endpoint}?{params}|v{version}"
+
+    def get(self, key):
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key, entry, ttl=None):
+        self.backend.set(key, entry, ttl)
+
+    def stats(self):
+        stats = {"hits": self.hits, "misses": self.misses}
+        if isinstance(self.backend, LRUBackend):
+            stats["size"] = len(self.backend)
+            stats["maxsize"] = self.backend.maxsize
+        return stats
+
+
+response_cache = ResponseCache(
+    load_backend(RESPONSE_CACHE_BACKEND)
+    if RESPONSE_CACHE_BACKEND
+    else LRUBackend(RESPONSE_CACHE_SIZE)
+)
+
+
+def render_entry(view, key, args, kwargs):
+    with coalesce.report_limiter.slot():
+        response = make_response(view(*args, **kwargs))
+    if response.status_code != 200 or response.is_streamed:
+        return response
+    payload = response.get_json(silent=True)
+    if isinstance(payload, dict) and "error" in payload:
+        return response
+    body = response.get_data()
+    entry = (body, response.mimetype, hashlib.sha256(body).hexdigest())
+    ttl = REPLICA_CACHE_TTL if current_replica() is not None else None
+    response_cache.set(key, entry, ttl)
+    return entry
+
+
+def too_busy():
+    response = jsonify(
+        {"error": "Hay demasiados reportes en ejecución, intenta de nuevo más tarde."}
+    )
+    response.status_code = 503
+    response.headers["Retry-After"] = str(coalesce.REPORT_RETRY_AFTER)
+    return response
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def note_commit(session):
+    if has_request_context():
+        g.session_committed = True
+
+
+def render_uncached(view, args, kwargs):
+    try:
+        with coalesce.report_limiter.slot():
+            return view(*args, **kwargs)
+    except QueryLimitExceeded:
+        return too_busy()
+
+
+def cached_response(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            key = response_cache.key(str(db.engine.url), request.endpoint, request.args)
+        except (ProgrammingError, OperationalError) as e:
+            # no data_version table (a database older than it, or before
+            # /create_tables): the response can not be keyed and the view reports
+            # its own errors
+            db.session.rollback()
+            logger.warning("Serving %s uncached: %s", request.endpoint, e)
+            return render_uncached(view, args, kwargs)
+        entry = response_cache.get(key)
+        if entry is None:
+            try:
+                entry, shared = coalesce.report_flight.do(
+                    key, lambda: render_entry(view, key, args, kwargs)
+                )
+                if not isinstance(entry, tuple) and shared:
+                    # errors and streamed bodies can not be shared, each caller
+                    # runs its own
+                    entry = render_entry(view, key, args, kwargs)
+            except QueryLimitExceeded:
+                return too_busy()
+            if not isinstance(entry, tuple):
+                return entry
+        body, mimetype, etag = entry
+        response = Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    return wrapper
+
+
+def bump_after_write():
+    try:
+        response_cache.bump_version()
+    except (ProgrammingError, OperationalError) as e:
+        # without the data_version table nothing is cached either
+        db.session.rollback()
+        logger.warning("Data version not bumped: %s", e)
+
+
+def invalidates_cache(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.session_committed = False
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            # chunked loads commit partial data before they fail
+            bump_after_write()
+            raise
+        # validation errors write nothing; a 4xx after committed chunks still bumps
+        if not 400 <= response.status_code < 500 or g.session_committed:
+            bump_after_write()
+        return response
+
+    return wrapper
@@ -0,0 +1,74 @@
+import contextlib
+import os
+import threading
+from .metrics import report_queries
+
+
+# heavy report queries running at once in this process, the rest wait for a slot
+REPORT_CONCURRENCY = int(os.getenv("REPORT_CONCURRENCY", "4"))
+REPORT_QUEUE_TIMEOUT = float(os.getenv("REPORT_QUEUE_TIMEOUT", "10"))
+REPORT_RETRY_AFTER = int(os.getenv("REPORT_RETRY_AFTER", "5"))
+
+
+class QueryLimitExceeded(Exception):
+    pass
+
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # identical calls in flight at the same time share the first one's result;
+    # returns the result and whether it came from another caller
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+        if not leader:
+            report_queries.inc(outcome="coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = function()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class QueryLimiter:
+    def __init__(self, limit, timeout):
+        self.limit = limit
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    @contextlib.contextmanager
+    def slot(self):
+        if not self._semaphore.acquire(timeout=self.timeout):
+            report_queries.inc(outcome="rejected")
+            raise QueryLimitExceeded()
+        report_queries.inc(outcome="executed")
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+report_flight = SingleFlight()
+report_limiter = QueryLimiter(REPORT_CONCURRENCY, REPORT_QUEUE_TIMEOUT)
@@ -0,0 +1,192 @@
+import hashlib
+import logging
+import os
+import tempfile
+import uuid
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+from flask import Response, send_file, stream_with_context
+from sqlalchemy import DateTime, Integer, select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from .cache import response_cache
+from .models import db, Department, Job, Employee
+from .replicas import current_replica
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+EXPORT_TABLES = {"employee": Employee, "department": Department, "job": Job}
+EXPORT_FORMATS = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+# rows fetched per server-side cursor batch, also the parquet row group size
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "65536"))
+# finished exports are kept here until the next upload, empty disables snapshots
+EXPORT_SNAPSHOT_DIR = os.getenv(
+    "EXPORT_SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "csv_api_exports")
+)
+
+
+def arrow_type(column):
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def export_schema(model, columns):
+    table_columns = model.__table__.columns
+    return pa.schema(
+        [
+            pa.field(
+                name, arrow_type(table_columns[name]), table_columns[name].nullable
+            )
+            for name in columns
+        ]
+    )
+
+
+def export_query(model, columns, hire_date_from=None, hire_date_to=None):
+    query = select(*[model.__table__.columns[name] for name in columns]).order_by(
+        model.id
+    )
+    if hire_date_from is not None:
+        query = query.where(model.hire_date >= hire_date_from)
+    if hire_date_to is not None:
+        query = query.where(model.hire_date < hire_date_to)
+    return query
+
+
+def record_batches(result, schema):
+    for rows in result.partitions():
+        arrays = [
+            pa.array(values, type=field.type)
+            for values, field in zip(zip(*rows), schema)
+        ]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class ChunkSink:
+    # file-like sink the arrow writers write into; drained after every batch
+    def __init__(self, snapshot=None):
+        self.chunks = []
+        self.position = 0
+        self.snapshot = snapshot
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        if self.snapshot is not None:
+            self.snapshot.write(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def open_writer(sink, schema, format):
+    if format == "parquet":
+        return pq.ParquetWriter(sink, schema)
+    return pa.ipc.new_stream(sink, schema)
+
+
+def snapshot_path(database, table, format, params):
+    key = f"{database}|{table}|{format}|{sorted(params.items())}"
+    digest = hashlib.sha256(key.encode()).hexdigest()[:32]
+    try:
+        version = response_cache.data_version()
+    except (ProgrammingError, OperationalError) as e:
+        # no data_version table, the export is served without a snapshot
+        db.session.rollback()
+        logger.warning("Export of %s without snapshot: %s", table, e)
+        return None
+    # the data version is shared by every process, so are the snapshots
+    name = f"{digest}-v{version}.{format}"
+    return os.path.join(EXPORT_SNAPSHOT_DIR, name)
+
+
+def remove_stale_snapshots(path):
+    # older versions of the same export
+    current = os.path.basename(path)
+    prefix = current.split("-v", 1)[0] + "-v"
+    for name in os.listdir(os.path.dirname(path)):
+        # part files are exports still being written
+        stale = name.startswith(prefix) and not name.endswith(".part")
+        if stale and name != current:
+            try:
+                os.remove(os.path.join(os.path.dirname(path), name))
+            except FileNotFoundError:
+                pass
+
+
+def export_body(result, schema, format, path=None):
+    snapshot = None
+    if path is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        snapshot = open(f"{path}.{uuid.uuid4().hex}.part", "wb")
+    sink = ChunkSink(snapshot)
+    completed = False
+    try:
+        writer = open_writer(sink, schema, format)
+        for batch in record_batches(result, schema):
+            if format == "parquet":
+                writer.write_batch(batch, row_group_size=EXPORT_BATCH_SIZE)
+            else:
+                writer.write_batch(batch)
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+        completed = True
+    finally:
+        result.close()
+        if snapshot is not None:
+            snapshot.close()
+            if completed:
+                os.replace(snapshot.name, path)
+                remove_stale_snapshots(path)
+            else:
+                os.remove(snapshot.name)
+
+
+def export_table(table, format, columns, hire_date_from=None, hire_date_to=None):
+    model = EXPORT_TABLES[table]
+    params = {"columns": columns, "from": hire_date_from, "to": hire_date_to}
+    path = None
+    # a lagging replica would keep a stale snapshot under the current version
+    if EXPORT_SNAPSHOT_DIR and current_replica() is None:
+        path = snapshot_path(str(db.engine.url), table, format, params)
+        if path is not None and os.path.exists(path):
+            logger.info("Serving %s export from snapshot %s", table, path)
+            return send_file(
+                path,
+                mimetype=EXPORT_FORMATS[format],
+                as_attachment=True,
+                download_name=f"{table}.{format}",
+            )
+
+    query = export_query(model, columns, hire_date_from, hire_date_to)
+    # executed before the response starts so database errors still map to a status
+    result = db.session.execute(
+        query.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+    )
+    body = export_body(result, export_schema(model, columns), format, path)
+    response = Response(stream_with_context(body), mimetype=EXPORT_FORMATS[format])
+    response.headers["Content-Disposition"] = f"attachment; filename={table}.{format}"
+    return response
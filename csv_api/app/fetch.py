@@ -0,0 +1,231 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+S3_CACHE_DIR = os.getenv(
+    "S3_CACHE_DIR", os.path.join(tempfile.gettempdir(), "csv_api_s3_cache")
+)
+S3_CACHE_MAX_BYTES = int(os.getenv("S3_CACHE_MAX_BYTES", str(2 << 30)))
+S3_RANGE_SIZE = int(os.getenv("S3_RANGE_SIZE", str(8 << 20)))
+S3_FETCH_WORKERS = int(os.getenv("S3_FETCH_WORKERS", "8"))
+# a directory laid out like the bucket (csv_files/<name>.csv) that stands in for S3
+S3_LOCAL_BUCKET = os.getenv("S3_LOCAL_BUCKET")
+
+
+class ObjectChanged(Exception):
+    pass
+
+
+class S3Bucket:
+    def __init__(self, name):
+        # botocore takes longer to import than the rest of the app together
+        import boto3
+
+        self.name = name
+        # the default session of boto3.client is not safe to build clients from
+        # several threads at once
+        self.client = boto3.session.Session().client("s3")
+
+    def head(self, key):
+        response = self.client.head_object(Bucket=self.name, Key=key)
+        return response["ETag"].strip('"'), response["ContentLength"]
+
+    def get_range(self, key, start, end, etag):
+        from botocore.exceptions import ClientError
+
+        try:
+            # every range of a download must come from the version that was HEADed
+            response = self.client.get_object(
+                Bucket=self.name,
+                Key=key,
+                Range=f"bytes={start}-{end - 1}",
+                IfMatch=f'"{etag}"',
+            )
+        except ClientError as e:
+            if e.response["ResponseMetadata"]["HTTPStatusCode"] == 412:
+                raise ObjectChanged(key) from e
+            raise
+        return response["Body"].read()
+
+
+class LocalBucket:
+    def __init__(self, root):
+        self.root = root
+
+    def head(self, key):
+        stat = os.stat(os.path.join(self.root, key))
+        return f"{stat.st_mtime_ns}-{stat.st_size}", stat.st_size
+
+    def get_range(self, key, start, end, etag):
+        with open(os.path.join(self.root, key), "rb") as f:
+            stat = os.fstat(f.fileno())
+            if f"{stat.st_mtime_ns}-{stat.st_size}" != etag:
+                raise ObjectChanged(key)
+            f.seek(start)
+            return f.read(end - start)
+
+
+class FileCache:
+    # objects are stored once per (key, ETag); the file mtime is the last use,
+    # and the least recently used files are evicted above max_bytes
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def path_for(self, key, etag):
+        digest = hashlib.sha256(f"{key}:{etag}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.csv")
+
+    def get(self, key, etag):
+        path = self.path_for(key, etag)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put(self, key, etag, write):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(key, etag)
+        # concurrent downloads of the same object each write their own part file
+        part_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            write(part_path)
+            os.replace(part_path, path)
+        finally:
+            if os.path.exists(part_path):
+                os.unlink(part_path)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".csv"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                os.unlink(path)
+                total -= size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "max_bytes": self.max_bytes,
+            }
+
+
+s3_cache = FileCache(S3_CACHE_DIR, S3_CACHE_MAX_BYTES)
+
+
+def byte_ranges(size, range_size):
+    return [
+        (start, min(start + range_size, size)) for start in range(0, size, range_size)
+    ]
+
+
+def download(bucket, key, etag, size, path):
+    ranges = byte_ranges(size, S3_RANGE_SIZE)
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+    def fetch_range(byte_range):
+        data = bucket.get_range(key, *byte_range, etag)
+        with open(path, "r+b") as f:
+            f.seek(byte_range[0])
+            f.write(data)
+
+    if len(ranges) <= 1:
+        for byte_range in ranges:
+            fetch_range(byte_range)
+        return
+    with ThreadPoolExecutor(max_workers=min(S3_FETCH_WORKERS, len(ranges))) as pool:
+        list(pool.map(fetch_range, ranges))
+
+
+def fetch_object(bucket, key, cache=s3_cache, retries=1):
+    etag, size = bucket.head(key)
+    path = cache.get(key, etag)
+    if path is not None:
+        return path
+    start = time.perf_counter()
+    try:
+        path = cache.put(
+            key, etag, lambda part: download(bucket, key, etag, size, part)
+        )
+    except ObjectChanged:
+        # overwritten during the download; the part file is already dropped
+        if not retries:
+            raise
+        logger.info("%s changed while it was fetched, fetching it again", key)
+        return fetch_object(bucket, key, cache, retries - 1)
+    logger.info(
+        "Fetched %s (%s bytes) in %.3fs", key, size, time.perf_counter() - start
+    )
+    return path
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def s3_bucket(name):
+    # one client per bucket and process, boto3 clients are slow to build and
+    # are not safe to share with forked workers; verify_tables and upload_batch
+    # ask for the first one from several threads
+    key = (name, os.getpid())
+    with _buckets_lock:
+        if key not in _buckets:
+            _buckets[key] = S3Bucket(name)
+        return _buckets[key]
+
+
+def get_bucket(name):
+    if S3_LOCAL_BUCKET:
+        return LocalBucket(S3_LOCAL_BUCKET)
+    return s3_bucket(name)
+
+
+def split_s3_path(file_path):
+    bucket, _, key = file_path[len("s3://") :].partition("/")
+    return bucket, key
+
+
+def object_version(file_path):
+    bucket, key = split_s3_path(file_path)
+    return get_bucket(bucket).head(key)
+
+
+def fetch_source(file_path):
+    # remote csvs are read from the local cache; local paths are used as they are
+    if not file_path.startswith("s3://"):
+        return file_path
+    bucket, key = split_s3_path(file_path)
+    return fetch_object(get_bucket(bucket), key)
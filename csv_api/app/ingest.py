@@ -0,0 +1,280 @@
+import logging
+import os
+import resource
+import time
+import fsspec
+import pandas as pd
+import sqlalchemy.exc
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import RequestEntityTooLarge
+from .cache import reference_cache
+from .fetch import fetch_source
+from .models import db, Department, Job, Employee, HireSummary
+from .loaders import keyed_load, load_dataframe, KEYED_MODES, UPLOAD_ENGINE
+from .metrics import timed_iter, upload_phase, upload_rows
+from .parallel import parallel_load_employees
+from .summary import hire_groups, merge_groups, refresh_hire_summary
+from .upload_body import UPLOAD_BODY_CHUNKSIZE, UploadBodyError
+from .utils import (
+    csv_kind,
+    pluralize,
+    process_csv_employee,
+    read_csv_file,
+    source_path,
+)
+from .watermarks import file_version, get_watermark, resume_offset, save_watermark
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def memory_mb():
+    # resident memory now; ru_maxrss is the peak since the process started
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        # no procfs, the process peak (in kilobytes on Linux) is the best there is
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class MemoryPeak:
+    # highest resident memory of one load, sampled while each chunk is in memory
+    def __init__(self):
+        self.peak = memory_mb()
+
+    def sample(self):
+        self.peak = max(self.peak, memory_mb())
+
+    def mb(self):
+        self.sample()
+        return round(self.peak, 1)
+
+
+def iter_upload_frames(file_value, file_path, chunksize=None, offset=0):
+    if offset:
+        with fsspec.open(file_path, "rb") as f:
+            f.seek(offset)
+            yield from iter_upload_frames(file_value, f, chunksize)
+        return
+    with upload_phase("read"):
+        reader = read_csv_file(file_path, file_value, chunksize)
+    if "departments" in file_value or "jobs" in file_value:
+        model = Department if "departments" in file_value else Job
+        column = "name" if model == Department else "title"
+        if chunksize is None:
+            reader.loc[len(reader)] = [-1, "not known"]
+            yield model, reader
+            return
+        for chunk in timed_iter(reader, "read"):
+            yield model, chunk
+        yield model, pd.DataFrame({"id": [-1], column: ["not known"]})
+    elif "employees" in file_value:
+        chunks = [reader] if chunksize is None else timed_iter(reader, "read")
+        for chunk in chunks:
+            with upload_phase("transform"):
+                df = process_csv_employee(chunk)
+            yield Employee, df
+
+
+def describe_upload_error(file_value, e):
+    if isinstance(e, IntegrityError):
+        return {
+            "error": f"There is information that has been inserted already, the unique key contraint in the table {file_value} doens't allow to insert the same key",
+            "detail": str(e),
+        }, 400
+    if isinstance(e, sqlalchemy.exc.ProgrammingError):
+        return {"error": f"You must create the tables in the database first {e}"}, 400
+    if isinstance(e, RequestEntityTooLarge):
+        return {"error": "El archivo supera el tamaño máximo permitido."}, 413
+    if isinstance(
+        e, (UploadBodyError, pd.errors.ParserError, pd.errors.EmptyDataError)
+    ):
+        return {"error": f"El csv enviado no es válido: {e}"}, 400
+    return {"error": str(e)}, 500
+
+
+def ingest_file_parallel(file_value, source, partitions):
+    file_path = source_path(file_value, source)
+    start = time.perf_counter()
+    memory = MemoryPeak()
+    with upload_phase("insert"):
+        # the partitions update the summary with the rows they load
+        rows, partitions = parallel_load_employees(fetch_source(file_path), partitions)
+    with upload_phase("commit"):
+        db.session.commit()
+    upload_rows.inc(rows, table=Employee.__tablename__)
+    elapsed = time.perf_counter() - start
+
+    logger.info(f"File {file_value} uploaded successfully")
+    return {
+        "message": f"File {file_value} uploaded successfully",
+        "engine": "parallel",
+        "rows": rows,
+        "partitions": partitions,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed else None,
+        "peak_memory_mb": memory.mb(),
+    }
+
+
+def check_watermark(file_path, local_path, mode):
+    version, size = file_version(file_path)
+    watermark = get_watermark(file_path)
+    unchanged = mode != "replace" and watermark and watermark.version == version
+    return {
+        "version": version,
+        "size": size,
+        "watermark": watermark,
+        "unchanged": bool(unchanged),
+        # a file that only grew is read from the last byte loaded
+        "offset": (
+            resume_offset(watermark, local_path, size)
+            if mode == "append" and not unchanged
+            else 0
+        ),
+    }
+
+
+def skipped_load(file_value, mode, watermark):
+    logger.info(f"File {file_value} has not changed since the last load")
+    return {
+        "message": f"File {file_value} has not changed since the last load",
+        "mode": mode,
+        "skipped": True,
+        "rows": 0,
+        "chunks": 0,
+        "loaded_at": watermark.loaded_at.isoformat(),
+    }
+
+
+def stored_employees(ids):
+    # read by the id range of the chunk, the files are ordered by id
+    columns = ["id", "hire_date", "department_id", "job_id"]
+    query = select(*[getattr(Employee, c) for c in columns]).where(
+        Employee.id.between(int(ids.min()), int(ids.max()))
+    )
+    df = pd.DataFrame(db.session.execute(query).all(), columns=columns)
+    df["hire_date"] = pd.to_datetime(df["hire_date"])
+    return df[df["id"].isin(ids)]
+
+
+def keyed_hire_groups(df, mode):
+    # what the rows change in the summary, read before they are loaded
+    if mode == "replace" or df.empty:
+        return hire_groups(df)
+    stored = stored_employees(df["id"])
+    if mode == "append":
+        # the ids already loaded are skipped
+        return hire_groups(df[~df["id"].isin(stored["id"])])
+    # updated rows leave the group of their old values
+    return merge_groups(hire_groups(df), hire_groups(stored))
+
+
+def load_frame(model, df, engine, mode):
+    with upload_phase("insert"):
+        if model != Employee:
+            if mode in KEYED_MODES:
+                return keyed_load(model, df, mode, engine)
+            return load_dataframe(model, df, engine)
+        if mode in KEYED_MODES:
+            groups = keyed_hire_groups(df, mode)
+            used_engine = keyed_load(model, df, mode, engine)
+        else:
+            groups = hire_groups(df)
+            used_engine = load_dataframe(model, df, engine)
+        # the summary is updated in the same transaction as the rows it counts
+        refresh_hire_summary(groups)
+        return used_engine
+
+
+def clear_table(model):
+    db.session.execute(delete(model))
+    if model == Employee:
+        # the load adds the groups of the whole file
+        db.session.execute(delete(HireSummary))
+
+
+def finish_keyed_load(file_path, local_path, mark, rows, mode):
+    if mark is not None:
+        previous_rows = mark["watermark"].rows if mark["offset"] else 0
+        save_watermark(
+            file_path,
+            local_path,
+            mark["version"],
+            mark["size"],
+            previous_rows + rows,
+            mode,
+        )
+    db.session.commit()
+
+
+def ingest_file(
+    file_value,
+    source,
+    engine=UPLOAD_ENGINE,
+    chunksize=None,
+    progress=None,
+    mode="insert",
+    stream=None,
+):
+    file_path = source_path(file_value, source) if stream is None else None
+    model = pluralize(csv_kind(file_value))
+    rows = 0
+    chunks = 0
+
+    start = time.perf_counter()
+    memory = MemoryPeak()
+    if stream is None:
+        local_path = fetch_source(file_path)
+    else:
+        # parsed while it is received, never held whole in memory
+        local_path = stream
+        chunksize = chunksize or UPLOAD_BODY_CHUNKSIZE
+    # a csv sent in the request body has no stable source to keep a watermark for
+    watermarked = mode in KEYED_MODES and stream is None
+    mark = check_watermark(file_path, local_path, mode) if watermarked else None
+    if mark is not None and mark["unchanged"]:
+        return skipped_load(file_value, mode, mark["watermark"])
+    offset = mark["offset"] if mark is not None else 0
+    if mode == "replace":
+        clear_table(model)
+
+    used_engine = engine
+    for model, df in iter_upload_frames(file_value, local_path, chunksize, offset):
+        logger.info("Loading rows: %s", df.shape)
+        used_engine = load_frame(model, df, engine, mode)
+        memory.sample()
+        # each chunk is committed on its own so memory does not grow with the file
+        with upload_phase("commit"):
+            db.session.commit()
+        if model in (Department, Job):
+            reference_cache.invalidate()
+        upload_rows.inc(len(df), table=model.__tablename__)
+        rows += len(df)
+        chunks += 1
+        if progress is not None:
+            progress(rows)
+
+    if mode in KEYED_MODES:
+        finish_keyed_load(file_path, local_path, mark, rows, mode)
+    elapsed = time.perf_counter() - start
+
+    logger.info(f"File {file_value} uploaded successfully")
+    result = {
+        "message": f"File {file_value} uploaded successfully",
+        "engine": used_engine,
+        "mode": mode,
+        "rows": rows,
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed else None,
+        "peak_memory_mb": memory.mb(),
+    }
+    if mark is not None:
+        result.update(skipped=False, byte_offset=offset)
+    if stream is not None:
+        result["source"] = "body"
+    return result
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+import fsspec
+from flask import current_app
+from .cache import bump_after_write
+from .fetch import fetch_source
+from .models import db, IngestJob
+from .ingest import ingest_file, describe_upload_error
+from .utils import source_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+INGEST_EXECUTOR = os.getenv("INGEST_EXECUTOR", "thread")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_JOB_CHUNKSIZE = int(os.getenv("INGEST_JOB_CHUNKSIZE", "50000"))
+
+_executor = None
+_process_app = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        if INGEST_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=INGEST_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=INGEST_WORKERS, thread_name_prefix="ingest"
+            )
+    return _executor
+
+
+def count_rows(file_value, file_path):
+    lines = 0
+    with fsspec.open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            lines += block.count(b"\n")
+    if "departments" in file_value or "jobs" in file_value:
+        lines += 1
+    return lines
+
+
+def submit_ingest_job(file_value, source, engine, chunksize=None, mode="insert"):
+    job = IngestJob(
+        id=uuid.uuid4().hex,
+        file=file_value,
+        source=source,
+        engine=engine,
+        status="queued",
+        rows_done=0,
+        created_at=datetime.utcnow(),
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    chunksize = chunksize or INGEST_JOB_CHUNKSIZE
+    app = current_app._get_current_object()
+    if isinstance(get_executor(), ProcessPoolExecutor):
+        get_executor().submit(
+            run_ingest_job_in_process,
+            app.config["SQLALCHEMY_DATABASE_URI"],
+            job.id,
+            file_value,
+            source,
+            engine,
+            chunksize,
+            mode,
+        )
+    else:
+        get_executor().submit(
+            run_ingest_job, app, job.id, file_value, source, engine, chunksize, mode
+        )
+    logger.info("Submitted ingest job %s for %s", job.id, file_value)
+    return job
+
+
+def run_ingest_job_in_process(database_uri, job_id, *args):
+    global _process_app
+    if _process_app is None:
+        from . import create_app
+
+        _process_app = create_app({"SQLALCHEMY_DATABASE_URI": database_uri})
+    run_ingest_job(_process_app, job_id, *args)
+
+
+def run_ingest_job(app, job_id, file_value, source, engine, chunksize, mode="insert"):
+    with app.app_context():
+        job = db.session.get(IngestJob, job_id)
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        db.session.commit()
+
+        def progress(rows_done):
+            IngestJob.query.filter_by(id=job_id).update({"rows_done": rows_done})
+            db.session.commit()
+            bump_after_write()
+
+        try:
+            # remote files are fetched into the local cache once, before counting
+            file_path = fetch_source(source_path(file_value, source))
+            job.rows_total = count_rows(file_value, file_path)
+            db.session.commit()
+            result = ingest_file(file_value, source, engine, chunksize, progress, mode)
+            status = "succeeded"
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error in ingest job {job_id}: {e}")
+            result, _ = describe_upload_error(file_value, e)
+            status = "failed"
+
+        job = db.session.get(IngestJob, job_id)
+        job.status = status
+        job.finished_at = datetime.utcnow()
+        job.result = json.dumps(result)
+        db.session.commit()
+        bump_after_write()
+
+
+def job_status(job):
+    now = job.finished_at or datetime.utcnow()
+    rows_per_sec = None
+    eta_seconds = None
+    if job.started_at is not None:
+        elapsed = (now - job.started_at).total_seconds()
+        if elapsed > 0:
+            rows_per_sec = round(job.rows_done / elapsed, 1)
+        if job.status == "running" and job.rows_total and rows_per_sec:
+            eta_seconds = round(
+                max(job.rows_total - job.rows_done, 0) / rows_per_sec, 1
+            )
+    return {
+        "id": job.id,
+        "file": job.file,
+        "source": job.source,
+        "engine": job.engine,
+        "status": job.status,
+        "rows_done": job.rows_done,
+        "rows_total": job.rows_total,
+        "rows_per_sec": rows_per_sec,
+        "eta_seconds": eta_seconds,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "result": json.loads(job.result) if job.result else None,
+    }
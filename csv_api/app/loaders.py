@@ -0,0 +1,197 @@
+import csv
+import io
+import logging
+import os
+import uuid
+from sqlalchemy import delete, insert, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from .models import db, Department, Job, Employee, HireSummary
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+UPLOAD_ENGINE = os.getenv("UPLOAD_ENGINE", "copy")
+UPLOAD_BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", "10000"))
+# insert: plain inserts; append: skip rows whose id is already loaded;
+# upsert: insert or update by id; replace: empty the table and load the file
+LOAD_MODES = ("insert", "append", "upsert", "replace")
+KEYED_MODES = ("append", "upsert", "replace")
+# id of the "not known" row in keyed loads, outside the ids of the csv files
+SENTINEL_ID = 0
+
+LOAD_COLUMNS = {
+    Department: ["name"],
+    Job: ["title"],
+    Employee: ["name", "job_id", "department_id", "hire_date"],
+}
+
+
+def orm_load(model, df):
+    columns = LOAD_COLUMNS[model]
+    for _, row in df.iterrows():
+        db.session.add(model(**{column: row[column] for column in columns}))
+    db.session.flush()
+    return "orm"
+
+
+def batch_load(model, df, columns=None):
+    columns = columns or LOAD_COLUMNS[model]
+    statement = insert(model.__table__)
+    for start in range(0, len(df), UPLOAD_BATCH_SIZE):
+        records = df[columns].iloc[start : start + UPLOAD_BATCH_SIZE].to_dict("records")
+        db.session.execute(statement, records)
+    return "batch"
+
+
+def copy_to_table(dbapi_connection, table_name, df, columns):
+    buffer = io.StringIO()
+    df[columns].to_csv(
+        buffer,
+        index=False,
+        header=False,
+        quoting=csv.QUOTE_NONNUMERIC,
+        date_format="%Y-%m-%d %H:%M:%S",
+    )
+    buffer.seek(0)
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
+def copy_load(model, df):
+    if db.session.get_bind().dialect.name != "postgresql":
+        logger.info("COPY is only available on PostgreSQL, using batch inserts")
+        return batch_load(model, df)
+    copy_to_table(
+        db.session.connection().connection,
+        model.__tablename__,
+        df,
+        LOAD_COLUMNS[model],
+    )
+    return "copy"
+
+
+ENGINES = {"copy": copy_load, "batch": batch_load, "orm": orm_load}
+
+
+def load_dataframe(model, df, engine=UPLOAD_ENGINE):
+    return ENGINES[engine](model, df)
+
+
+def dialect_insert(table):
+    # INSERT ... ON CONFLICT is spelled the same on PostgreSQL and SQLite but
+    # each dialect ships its own insert construct
+    if db.session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def sync_id_sequence(model, table=None):
+    # rows loaded with explicit ids do not advance the PostgreSQL sequence
+    if db.session.get_bind().dialect.name != "postgresql":
+        return
+    table = table or model.__tablename__
+    db.session.execute(
+        text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"(SELECT MAX(id) FROM {table}))"
+        )
+    )
+
+
+def conflict_clause(model, update):
+    columns = LOAD_COLUMNS[model]
+    if update:
+        assignments = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns)
+        return f"ON CONFLICT (id) DO UPDATE SET {assignments}"
+    return "ON CONFLICT (id) DO NOTHING"
+
+
+def keyed_batch_load(model, df, update):
+    columns = ["id"] + LOAD_COLUMNS[model]
+    statement = dialect_insert(model.__table__)
+    if update:
+        statement = statement.on_conflict_do_update(
+            index_elements=["id"],
+            set_={c: statement.excluded[c] for c in LOAD_COLUMNS[model]},
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=["id"])
+    for start in range(0, len(df), UPLOAD_BATCH_SIZE):
+        records = df[columns].iloc[start : start + UPLOAD_BATCH_SIZE].to_dict("records")
+        db.session.execute(statement, records)
+    return "batch"
+
+
+def keyed_copy_load(model, df, update):
+    if db.session.get_bind().dialect.name != "postgresql":
+        return keyed_batch_load(model, df, update)
+    table = model.__tablename__
+    columns = ["id"] + LOAD_COLUMNS[model]
+    staging_table = f"{table}_staging_{uuid.uuid4().hex[:8]}"
+    db.session.execute(
+        text(f"CREATE TEMP TABLE {staging_table} (LIKE {table}) ON COMMIT DROP")
+    )
+    copy_to_table(db.session.connection().connection, staging_table, df, columns)
+    column_list = ", ".join(columns)
+    db.session.execute(
+        text(
+            f"INSERT INTO {table} ({column_list}) "
+            f"SELECT {column_list} FROM {staging_table} ORDER BY id "
+            f"{conflict_clause(model, update)}"
+        )
+    )
+    return "copy"
+
+
+def move_sentinel(model):
+    # a "not known" row loaded with a generated id holds an id a later csv row
+    # may claim, it is moved to SENTINEL_ID with the rows pointing to it
+    column = LOAD_COLUMNS[model][0]
+    table = model.__table__
+    old_id = db.session.execute(
+        select(table.c.id).where(
+            table.c[column] == "not known", table.c.id != SENTINEL_ID
+        )
+    ).scalar()
+    if old_id is None:
+        return
+    key = "department_id" if model == Department else "job_id"
+    # the name is unique, the old row gives it up before the new one takes it
+    db.session.execute(
+        update(table)
+        .where(table.c.id == old_id)
+        .values({column: f"not known {old_id}"})
+    )
+    db.session.execute(insert(table).values({"id": SENTINEL_ID, column: "not known"}))
+    for child in (Employee.__table__, HireSummary.__table__):
+        db.session.execute(
+            update(child).where(child.c[key] == old_id).values({key: SENTINEL_ID})
+        )
+    db.session.execute(delete(table).where(table.c.id == old_id))
+
+
+def keyed_load(model, df, mode, engine=UPLOAD_ENGINE):
+    # the "not known" row carries id -1 in the frame and is stored with
+    # SENTINEL_ID, only inserted when missing
+    sentinel = df["id"] == -1
+    if model in (Department, Job):
+        # before the first chunk, which may carry the id the old row holds
+        move_sentinel(model)
+    update = mode != "append"
+    load = keyed_copy_load if engine == "copy" else keyed_batch_load
+    used_engine = load(model, df[~sentinel], update)
+    sync_id_sequence(model)
+    if sentinel.any():
+        statement = dialect_insert(model.__table__).on_conflict_do_nothing()
+        records = df.loc[sentinel, LOAD_COLUMNS[model]].to_dict("records")
+        for record in records:
+            record["id"] = SENTINEL_ID
+        db.session.execute(statement, records)
+    return used_engine
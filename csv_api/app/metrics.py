@@ -0,0 +1,225 @@
+import contextlib
+import os
+import threading
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# adds a Server-Timing header with the phase and SQL timings of each request
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") in ("1", "true")
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in sorted(self._series.items())
+            ]
+        for key, (counts, total, count) in items:
+            labels = list(zip(self.labels, key))
+            for bound, bucket_count in zip(self.buckets, counts):
+                bucket_labels = format_labels(labels + [("le", repr(bound))])
+                lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+            inf_labels = format_labels(labels + [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            labels = format_labels(list(zip(self.labels, key)))
+            lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{escape_label(value)}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+request_duration = Histogram(
+    "csv_api_request_duration_seconds",
+    "Request latency by endpoint, method and status.",
+    ["endpoint", "method", "status"],
+)
+upload_phase_duration = Histogram(
+    "csv_api_upload_phase_seconds",
+    "Time spent in each upload phase (read, transform, insert, commit).",
+    ["phase"],
+)
+upload_rows = Counter(
+    "csv_api_upload_rows_total", "Rows loaded by /upload_csv.", ["table"]
+)
+sql_duration = Histogram(
+    "csv_api_sql_statement_seconds",
+    "SQL statement execution time by statement type.",
+    ["statement"],
+)
+report_queries = Counter(
+    "csv_api_report_queries_total",
+    "Report computations executed, coalesced into another one or rejected.",
+    ["outcome"],
+)
+replica_requests = Counter(
+    "csv_api_replica_requests_total",
+    "Read-only requests by the database that served them.",
+    ["target"],
+)
+
+
+def record_timing(name, seconds):
+    if has_request_context():
+        timings = g.setdefault("timings", {})
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def upload_phase(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        upload_phase_duration.observe(elapsed, phase=phase)
+        record_timing(phase, elapsed)
+
+
+def timed_iter(iterable, phase):
+    iterator = iter(iterable)
+    while True:
+        with upload_phase(phase):
+            item = next(iterator, None)
+        if item is None:
+            return
+        yield item
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+    sql_duration.observe(elapsed, statement=keyword)
+    record_timing("sql", elapsed)
+
+
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+def observe_request(response):
+    start = g.pop("request_start", None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    # streamed responses are measured up to the first byte
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    request_duration.observe(
+        elapsed,
+        endpoint=endpoint,
+        method=request.method,
+        status=response.status_code,
+    )
+    if SERVER_TIMING:
+        timings = dict(g.get("timings", {}), total=elapsed)
+        response.headers["Server-Timing"] = ", ".join(
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()
+        )
+    return response
+
+
+def cache_lines(caches):
+    lines = []
+    for field in ("hits", "misses"):
+        name = f"csv_api_cache_{field}_total"
+        lines += [f"# HELP {name} Cache {field} by cache.", f"# TYPE {name} counter"]
+        for cache, stats in caches.items():
+            lines.append(f"{name}{format_labels([('cache', cache)])} {stats[field]}")
+    name = "csv_api_cache_hit_ratio"
+    lines += [f"# HELP {name} Share of lookups that hit.", f"# TYPE {name} gauge"]
+    for cache, stats in caches.items():
+        lookups = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / lookups if lookups else 0.0
+        lines.append(f"{name}{format_labels([('cache', cache)])} {ratio}")
+    return lines
+
+
+def render_metrics(caches):
+    lines = []
+    for metric in (
+        request_duration,
+        upload_phase_duration,
+        upload_rows,
+        sql_duration,
+        report_queries,
+        replica_requests,
+    ):
+        lines += metric.render()
+    lines += cache_lines(caches)
+    return "\n".join(lines) + "\n"
@@ -18,3 +18,52 @@ class Employee(db.Model):
     job_id = db.Column(db.Integer, db.ForeignKey("job.id"), nullable=True)
     department_id = db.Column(db.Integer, db.ForeignKey("department.id"), nullable=True)
     hire_date = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index(
+            "ix_employee_hire_date_department_job",
+            "hire_date",
+            "department_id",
+            "job_id",
+        ),
+        db.Index("ix_employee_department_hire_date", "department_id", "hire_date"),
+        db.Index("ix_employee_job_hire_date", "job_id", "hire_date"),
+    )
+
+
+class IngestJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    file = db.Column(db.String(100), nullable=False)
+    source = db.Column(db.String(20), nullable=True)
+    engine = db.Column(db.String(20), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    rows_done = db.Column(db.Integer, nullable=False, default=0)
+    rows_total = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+
+
+class HireSummary(db.Model):
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    quarter = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    department_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    job_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    hired = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LoadWatermark(db.Model):
+    source_path = db.Column(db.String(255), primary_key=True)
+    version = db.Column(db.String(100), nullable=False)
+    byte_offset = db.Column(db.BigInteger, nullable=False, default=0)
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    checksum = db.Column(db.String(32), nullable=True)
+    mode = db.Column(db.String(20), nullable=True)
+    loaded_at = db.Column(db.DateTime, nullable=False)
+
+
+class DataVersion(db.Model):
+    # one row, changed by every write; cached responses are keyed by it
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.String(32), nullable=False)
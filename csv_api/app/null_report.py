@@ -0,0 +1,54 @@
+import json
+from sqlalchemy import select
+from .models import db, Department, Job
+from .reports import employee_defaults_query
+
+
+def format_default(value, has_nulls):
+    # keep the text pandas produced: nan for an empty table and a float when
+    # the column held nulls
+    if value is None:
+        return "nan"
+    return f"{float(value)}" if has_nulls else f"{value}"
+
+
+def null_report():
+    results_list = []
+    row = db.session.execute(employee_defaults_query()).one()
+    max_job_id = format_default(row.max_job_id, row.job_id_nulls)
+    max_department_id = format_default(row.max_department_id, row.department_id_nulls)
+    max_hire_date = row.min_hire_date if row.min_hire_date is not None else "NaT"
+    not_known_departments = db.session.execute(
+        select(Department.id, Department.name).where(Department.name == "not known")
+    )
+    not_known_jobs = db.session.execute(
+        select(Job.id, Job.title).where(Job.title == "not known")
+    )
+    results_list.append(
+        {
+            "message": json.dumps(
+                [dict(r._mapping) for r in not_known_departments],
+                separators=(",", ":"),
+            ),
+            "table": "Department",
+        }
+    )
+    results_list.append(
+        {
+            "message": json.dumps(
+                [dict(r._mapping) for r in not_known_jobs], separators=(",", ":")
+            ),
+            "table": "Job",
+        }
+    )
+    results_list.append(
+        {
+            "count_nulls_job_id": f"valor por defecto en la BD:{max_job_id}  conteo: {row.job_id_count}",
+            "count_nulls_department_id": f"valor por defecto en la BD: {max_department_id} conteo: {row.department_id_count}",
+            "nan_count_name": row.name_null_count,
+            # the original report counted the job_id default here as well
+            "nan_hire_date": f"valor por defecto en BD {max_hire_date} conteo: {row.job_id_count}",
+            "table": "Employees",
+        }
+    )
+    return results_list
@@ -0,0 +1,118 @@
+import io
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import fsspec
+from sqlalchemy import column, create_engine, table, text
+from sqlalchemy.pool import NullPool
+from .models import db, Employee
+from .loaders import LOAD_COLUMNS, batch_load, copy_to_table, sync_id_sequence
+from .summary import hire_groups, refresh_hire_summary, table_hire_groups
+from .utils import process_csv_employee, read_csv_file, sentinel_ids
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+EMPLOYEE_COLUMNS = ["id"] + LOAD_COLUMNS[Employee]
+MAX_PARTITIONS = int(os.getenv("MAX_PARTITIONS", str(os.cpu_count() or 1)))
+
+
+def split_byte_ranges(file_path, partitions):
+    with fsspec.open(file_path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        boundaries = [0]
+        for i in range(1, partitions):
+            f.seek(max(size * i // partitions, boundaries[-1]))
+            # move forward to the start of the next line
+            f.readline()
+            boundaries.append(min(f.tell(), size))
+        boundaries.append(size)
+    return [
+        (start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start
+    ]
+
+
+def read_partition(file_path, start, end, null_ids):
+    with fsspec.open(file_path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    df = read_csv_file(io.BytesIO(data), "hired_employees")
+    return process_csv_employee(df, null_ids)
+
+
+def copy_partition(database_url, staging_table, file_path, byte_range, null_ids):
+    df = read_partition(file_path, *byte_range, null_ids)
+    engine = create_engine(database_url, poolclass=NullPool)
+    connection = engine.raw_connection()
+    try:
+        copy_to_table(connection, staging_table, df, EMPLOYEE_COLUMNS)
+        connection.commit()
+    finally:
+        connection.close()
+        engine.dispose()
+    return len(df)
+
+
+def transform_partition(file_path, byte_range, null_ids):
+    return read_partition(file_path, *byte_range, null_ids)
+
+
+def parallel_load_employees(file_path, partitions):
+    partitions = max(1, min(partitions, MAX_PARTITIONS))
+    null_ids = sentinel_ids()
+    ranges = split_byte_ranges(file_path, partitions)
+    bind = db.session.get_bind()
+    logger.info("Loading %s in %s partitions", file_path, len(ranges))
+
+    if bind.dialect.name != "postgresql":
+        # SQLite allows a single writer, so only parsing and transforming
+        # run in parallel and the parent process does the inserts
+        rows = 0
+        with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+            for df in pool.map(
+                transform_partition, repeat(file_path), ranges, repeat(null_ids)
+            ):
+                batch_load(Employee, df, EMPLOYEE_COLUMNS)
+                refresh_hire_summary(hire_groups(df))
+                rows += len(df)
+        return rows, len(ranges)
+
+    staging_table = f"employee_staging_{uuid.uuid4().hex[:8]}"
+    with bind.begin() as connection:
+        connection.execute(
+            text(f"CREATE UNLOGGED TABLE {staging_table} (LIKE employee)")
+        )
+    try:
+        database_url = bind.url.render_as_string(hide_password=False)
+        with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+            rows = sum(
+                pool.map(
+                    copy_partition,
+                    repeat(database_url),
+                    repeat(staging_table),
+                    repeat(file_path),
+                    ranges,
+                    repeat(null_ids),
+                )
+            )
+        columns = ", ".join(EMPLOYEE_COLUMNS)
+        db.session.execute(
+            text(
+                f"INSERT INTO employee ({columns}) "
+                f"SELECT {columns} FROM {staging_table} ORDER BY id"
+            )
+        )
+        sync_id_sequence(Employee)
+        staging = table(staging_table, *[column(name) for name in EMPLOYEE_COLUMNS])
+        refresh_hire_summary(table_hire_groups(staging))
+        # dropped inside the merge transaction so the swap commits atomically
+        db.session.execute(text(f"DROP TABLE {staging_table}"))
+    except Exception:
+        db.session.rollback()
+        with bind.begin() as connection:
+            connection.execute(text(f"DROP TABLE IF EXISTS {staging_table}"))
+        raise
+    return rows, len(ranges)
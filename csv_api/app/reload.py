@@ -0,0 +1,379 @@
+import contextlib
+import fcntl
+import logging
+import os
+import threading
+import time
+from sqlalchemy import (
+    Column,
+    ForeignKeyConstraint,
+    Index,
+    MetaData,
+    Table,
+    UniqueConstraint,
+    func,
+    insert,
+    select,
+    text,
+)
+from .cache import reference_cache
+from .fetch import fetch_source
+from .loaders import UPLOAD_BATCH_SIZE, copy_to_table, sync_id_sequence
+from .metrics import timed_iter, upload_phase, upload_rows
+from .models import db, Department, Job, Employee, HireSummary
+from .summary import hires_by_quarter
+from .utils import process_csv_employee, read_csv_file, source_path
+from .watermarks import file_version, save_watermark
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+RELOAD_CHUNKSIZE = int(os.getenv("RELOAD_CHUNKSIZE", "100000"))
+SHADOW_SUFFIX = "__shadow"
+RELOAD_FILES = (
+    ("departments", Department),
+    ("jobs", Job),
+    ("hired_employees", Employee),
+)
+# dropped in this order, employee references department and job
+SWAPPED_MODELS = (HireSummary, Employee, Job, Department)
+# pg_advisory_lock key of the reload, any number no other lock of the app uses
+RELOAD_LOCK_KEY = 728150
+_memory_reload_lock = threading.Lock()
+
+
+class ReloadError(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def reload_lock():
+    # one reload at a time across every worker and process, the shadow tables
+    # are shared; yields whether the lock was taken
+    engine = db.engine
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as connection:
+            locked = connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": RELOAD_LOCK_KEY}
+            ).scalar()
+            connection.commit()
+            try:
+                yield locked
+            finally:
+                if locked:
+                    connection.execute(
+                        text("SELECT pg_advisory_unlock(:key)"),
+                        {"key": RELOAD_LOCK_KEY},
+                    )
+                    connection.commit()
+        return
+    database = engine.url.database
+    if not database or database == ":memory:":
+        # an in-memory database belongs to a single process
+        locked = _memory_reload_lock.acquire(blocking=False)
+        try:
+            yield locked
+        finally:
+            if locked:
+                _memory_reload_lock.release()
+        return
+    # released by the OS if the process dies in the middle of a reload
+    with open(f"{database}.reload-lock", "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def shadow_name(name):
+    return f"{name}{SHADOW_SUFFIX}"
+
+
+def is_postgresql():
+    return db.session.get_bind().dialect.name == "postgresql"
+
+
+def shadow_tables(inline_constraints):
+    # same columns and primary keys as the live tables; unique and foreign keys
+    # are added after the load on PostgreSQL and secondary indexes always are
+    metadata = MetaData()
+    tables = {}
+    for model in reversed(SWAPPED_MODELS):
+        live = model.__table__
+        items = [
+            Column(
+                column.name,
+                column.type,
+                primary_key=column.primary_key,
+                nullable=column.nullable,
+                autoincrement=column.autoincrement,
+            )
+            for column in live.columns
+        ]
+        if inline_constraints:
+            items += [
+                UniqueConstraint(column.name)
+                for column in live.columns
+                if column.unique
+            ]
+            items += [
+                ForeignKeyConstraint(
+                    [key.parent.name],
+                    [f"{shadow_name(key.column.table.name)}.{key.column.name}"],
+                )
+                for key in live.foreign_keys
+            ]
+        tables[model] = Table(shadow_name(live.name), metadata, *items)
+    return metadata, tables
+
+
+def add_deferred_constraints(tables):
+    for model, shadow in tables.items():
+        for column in model.__table__.columns:
+            if column.unique:
+                db.session.execute(
+                    text(
+                        f"ALTER TABLE {shadow.name} ADD CONSTRAINT "
+                        f"{shadow.name}_{column.name}_key UNIQUE ({column.name})"
+                    )
+                )
+        for key in model.__table__.foreign_keys:
+            column = key.parent.name
+            db.session.execute(
+                text(
+                    f"ALTER TABLE {shadow.name} ADD CONSTRAINT "
+                    f"{shadow.name}_{column}_fkey FOREIGN KEY ({column}) "
+                    f"REFERENCES {shadow_name(key.column.table.name)} "
+                    f"({key.column.name})"
+                )
+            )
+
+
+def create_indexes(tables, connection, suffix):
+    for model, table in tables.items():
+        for index in model.__table__.indexes:
+            Index(
+                f"{index.name}{suffix}",
+                *[table.c[column.name] for column in index.columns],
+                unique=index.unique,
+            ).create(connection)
+
+
+def insert_rows(table, df, columns):
+    if is_postgresql():
+        copy_to_table(db.session.connection().connection, table.name, df, columns)
+        return
+    statement = insert(table)
+    for start in range(0, len(df), UPLOAD_BATCH_SIZE):
+        records = df[columns].iloc[start : start + UPLOAD_BATCH_SIZE].to_dict("records")
+        db.session.execute(statement, records)
+
+
+def count_rows(table):
+    return db.session.execute(select(func.count()).select_from(table)).scalar()
+
+
+def sentinel_id(table, column):
+    return db.session.execute(
+        select(table.c.id).where(table.c[column] == "not known")
+    ).scalar()
+
+
+def load_shadow_table(file_value, model, table, local_path, null_ids=None):
+    rows = 0
+    with upload_phase("read"):
+        reader = read_csv_file(local_path, file_value, RELOAD_CHUNKSIZE)
+    for chunk in timed_iter(reader, "read"):
+        if model == Employee:
+            with upload_phase("transform"):
+                chunk = process_csv_employee(chunk, null_ids)
+        with upload_phase("insert"):
+            insert_rows(table, chunk, list(table.columns.keys()))
+        with upload_phase("commit"):
+            db.session.commit()
+        rows += len(chunk)
+
+    sync_id_sequence(model, table.name)
+    if model in (Department, Job):
+        # the "not known" row keeps a generated id, as in the other load modes
+        column = "name" if model == Department else "title"
+        db.session.execute(insert(table).values({column: "not known"}))
+        rows += 1
+    db.session.commit()
+    return rows
+
+
+def rename_shadow_objects(connection, tables):
+    # constraints, indexes and sequences keep the names of the shadow tables
+    for table in tables.values():
+        live = table.name[: -len(SHADOW_SUFFIX)]
+        constraints = (
+            connection.execute(
+                text(
+                    "SELECT conname FROM pg_constraint "
+                    "WHERE conrelid = CAST(:table AS regclass)"
+                ),
+                {"table": live},
+            )
+            .scalars()
+            .all()
+        )
+        for name in constraints:
+            if SHADOW_SUFFIX in name:
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {live} RENAME CONSTRAINT {name} "
+                        f"TO {name.replace(SHADOW_SUFFIX, '')}"
+                    )
+                )
+        indexes = (
+            connection.execute(
+                text("SELECT indexname FROM pg_indexes WHERE tablename = :table"),
+                {"table": live},
+            )
+            .scalars()
+            .all()
+        )
+        for name in indexes:
+            if SHADOW_SUFFIX in name:
+                connection.execute(
+                    text(
+                        f"ALTER INDEX {name} RENAME TO {name.replace(SHADOW_SUFFIX, '')}"
+                    )
+                )
+        if "id" not in table.c:
+            continue
+        sequence = connection.execute(
+            text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": live}
+        ).scalar()
+        if sequence and SHADOW_SUFFIX in sequence:
+            connection.execute(
+                text(
+                    f"ALTER SEQUENCE {sequence} RENAME TO "
+                    f"{sequence.split('.')[-1].replace(SHADOW_SUFFIX, '')}"
+                )
+            )
+
+
+def swap_tables(tables):
+    postgresql = is_postgresql()
+    with db.engine.connect() as connection:
+        if not postgresql:
+            # pysqlite runs DDL outside of transactions unless one is open
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+        for model in SWAPPED_MODELS:
+            connection.execute(text(f"DROP TABLE IF EXISTS {model.__tablename__}"))
+        for model in reversed(SWAPPED_MODELS):
+            connection.execute(
+                text(
+                    f"ALTER TABLE {tables[model].name} "
+                    f"RENAME TO {model.__tablename__}"
+                )
+            )
+        if postgresql:
+            rename_shadow_objects(connection, tables)
+        else:
+            # SQLite can not rename indexes, they are built on the swapped tables
+            live_metadata = MetaData()
+            live_tables = {
+                model: Table(
+                    model.__tablename__, live_metadata, autoload_with=connection
+                )
+                for model in tables
+            }
+            create_indexes(live_tables, connection, "")
+        connection.commit()
+
+
+def drop_shadow_tables():
+    db.session.rollback()
+    with db.engine.connect() as connection:
+        for model in SWAPPED_MODELS:
+            name = shadow_name(model.__tablename__)
+            connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        connection.commit()
+
+
+def reload_tables(source):
+    postgresql = is_postgresql()
+    metadata, tables = shadow_tables(inline_constraints=not postgresql)
+    timings = {}
+    rows = {}
+    start = time.perf_counter()
+    # leftovers of a reload that did not finish
+    drop_shadow_tables()
+    metadata.create_all(db.engine)
+    try:
+        null_ids = None
+        sources = {}
+        for file_value, model in RELOAD_FILES:
+            file_path = source_path(file_value, source)
+            version, size = file_version(file_path)
+            local_path = fetch_source(file_path)
+            sources[file_value] = (file_path, local_path, version, size)
+            rows[model.__tablename__] = load_shadow_table(
+                file_value, model, tables[model], local_path, null_ids
+            )
+            if model == Job:
+                null_ids = (
+                    sentinel_id(tables[Department], "name"),
+                    sentinel_id(tables[Job], "title"),
+                )
+        with upload_phase("insert"):
+            summary_columns = list(tables[HireSummary].columns.keys())
+            db.session.execute(
+                insert(tables[HireSummary]).from_select(
+                    summary_columns, hires_by_quarter(employee=tables[Employee])
+                )
+            )
+            db.session.commit()
+        timings["load"] = time.perf_counter() - start
+
+        index_start = time.perf_counter()
+        with upload_phase("index"):
+            if postgresql:
+                add_deferred_constraints(tables)
+                create_indexes(tables, db.session.connection(), SHADOW_SUFFIX)
+                db.session.commit()
+        timings["index"] = time.perf_counter() - index_start
+
+        for model, table in tables.items():
+            expected = rows.get(model.__tablename__)
+            loaded = count_rows(table)
+            if expected is not None and loaded != expected:
+                raise ReloadError(
+                    f"La tabla {table.name} tiene {loaded} filas y se esperaban {expected}."
+                )
+        db.session.commit()
+    except Exception:
+        drop_shadow_tables()
+        raise
+
+    swap_start = time.perf_counter()
+    with upload_phase("swap"):
+        swap_tables(tables)
+    timings["swap"] = time.perf_counter() - swap_start
+    reference_cache.invalidate()
+
+    for file_value, model in RELOAD_FILES:
+        upload_rows.inc(rows[model.__tablename__], table=model.__tablename__)
+        file_path, local_path, version, size = sources[file_value]
+        save_watermark(
+            file_path, local_path, version, size, rows[model.__tablename__], "reload"
+        )
+    db.session.commit()
+    elapsed = time.perf_counter() - start
+
+    logger.info("Tables reloaded in %.3fs", elapsed)
+    return {
+        "message": "Tables reloaded successfully",
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "phases": {phase: round(seconds, 3) for phase, seconds in timings.items()},
+    }
@@ -0,0 +1,103 @@
+import functools
+import logging
+import threading
+import time
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+from .metrics import replica_requests
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+REPLICA_HEALTH_INTERVAL = 10.0
+REPLICA_RETRY_AFTER = 30.0
+
+
+class RoutingSession(Session):
+    # read-only views set g.replica_engine; everything else uses the primary
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            replica = g.get("replica_engine")
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause, bind, **kwargs)
+
+
+class ReplicaPool:
+    def __init__(self, urls, health_interval, retry_after):
+        self.engines = [create_engine(url, pool_pre_ping=True) for url in urls]
+        self.health_interval = health_interval
+        self.retry_after = retry_after
+        self._checked_at = [None] * len(self.engines)
+        self._down_until = [0.0] * len(self.engines)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def healthy(self, index):
+        now = time.monotonic()
+        if now < self._down_until[index]:
+            return False
+        checked_at = self._checked_at[index]
+        if checked_at is not None and now - checked_at < self.health_interval:
+            return True
+        engine = self.engines[index]
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except Exception as e:
+            logger.warning("Replica %s is down: %s", engine.url, e)
+            self._down_until[index] = now + self.retry_after
+            return False
+        self._checked_at[index] = now
+        return True
+
+    def choose(self):
+        # round robin over the healthy replicas, None means the primary
+        for _ in range(len(self.engines)):
+            with self._lock:
+                index = self._next
+                self._next = (index + 1) % len(self.engines)
+            if self.healthy(index):
+                return self.engines[index]
+        return None
+
+
+def replica_pool():
+    app = current_app._get_current_object()
+    if "replica_pool" not in app.extensions:
+        urls = app.config.get("SQLALCHEMY_REPLICA_URLS") or []
+        app.extensions["replica_pool"] = (
+            ReplicaPool(
+                urls,
+                app.config.get("REPLICA_HEALTH_INTERVAL", REPLICA_HEALTH_INTERVAL),
+                app.config.get("REPLICA_RETRY_AFTER", REPLICA_RETRY_AFTER),
+            )
+            if urls
+            else None
+        )
+    return app.extensions["replica_pool"]
+
+
+def use_replica(engine):
+    g.replica_engine = engine
+
+
+def current_replica():
+    return g.get("replica_engine")
+
+
+def read_only(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        pool = replica_pool()
+        if pool is not None:
+            engine = pool.choose()
+            # kept for the whole request so streamed responses read the same replica
+            use_replica(engine)
+            target = engine.url.render_as_string() if engine else "primary"
+            replica_requests.inc(target=target)
+        return view(*args, **kwargs)
+
+    return wrapper
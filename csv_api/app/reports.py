@@ -0,0 +1,112 @@
+from datetime import datetime
+from sqlalchemy import Integer, case, cast, extract, func, or_, select
+from .models import Department, Job, Employee, HireSummary
+
+
+REPORT_YEAR = 2021
+REPORT1_COLUMNS = ["department", "job", "Q1", "Q2", "Q3", "Q4"]
+REPORT2_COLUMNS = ["id", "deparment", "hired"]
+
+
+def quarter_of(column):
+    month = cast(extract("month", column), Integer)
+    return case((month <= 3, 1), (month <= 6, 2), (month <= 9, 3), else_=4)
+
+
+def hires_subquery(year, department_id=None, job_id=None, live=False):
+    if live:
+        # range predicates on hire_date instead of EXTRACT(year ...) = N so the
+        # composite indexes on employee can be used
+        quarter = quarter_of(Employee.hire_date)
+        query = (
+            select(
+                Employee.department_id.label("department_id"),
+                Employee.job_id.label("job_id"),
+                quarter.label("quarter"),
+                func.count(Employee.id).label("hired"),
+            )
+            .where(
+                Employee.hire_date >= datetime(year, 1, 1),
+                Employee.hire_date < datetime(year + 1, 1, 1),
+            )
+            .group_by(Employee.department_id, Employee.job_id, quarter)
+        )
+        department_column, job_column = Employee.department_id, Employee.job_id
+    else:
+        query = select(
+            HireSummary.department_id,
+            HireSummary.job_id,
+            HireSummary.quarter,
+            HireSummary.hired,
+        ).where(HireSummary.year == year)
+        department_column, job_column = HireSummary.department_id, HireSummary.job_id
+
+    if department_id is not None:
+        query = query.where(department_column == department_id)
+    if job_id is not None:
+        query = query.where(job_column == job_id)
+    return query.subquery("hires")
+
+
+def report1_query(year=REPORT_YEAR, department_id=None, job_id=None, live=False):
+    hires = hires_subquery(year, department_id, job_id, live)
+    quarters = [
+        func.sum(case((hires.c.quarter == quarter, hires.c.hired), else_=0)).label(
+            f"Q{quarter}"
+        )
+        for quarter in (1, 2, 3, 4)
+    ]
+    return (
+        select(Department.name.label("department"), Job.title.label("job"), *quarters)
+        .select_from(hires)
+        .join(Job, hires.c.job_id == Job.id)
+        .join(Department, hires.c.department_id == Department.id)
+        .group_by(Department.name, Job.title, hires.c.quarter)
+        .order_by(Department.name, Job.title)
+    )
+
+
+def report2_query(year=REPORT_YEAR, department_id=None, job_id=None, live=False):
+    hires = hires_subquery(year, department_id, job_id, live)
+    hired = func.sum(hires.c.hired)
+    count_hires = (
+        select(
+            Department.id.label("department_id"),
+            Department.name.label("department"),
+            hired.label("hired"),
+            func.avg(hired).over().label("mean_hires_by_dept"),
+        )
+        .join(hires, Department.id == hires.c.department_id)
+        .group_by(Department.id, Department.name)
+        .subquery("count_hires")
+    )
+    return select(
+        count_hires.c.department_id, count_hires.c.department, count_hires.c.hired
+    ).where(count_hires.c.mean_hires_by_dept < count_hires.c.hired)
+
+
+def employee_defaults_query():
+    # one pass over employee: the process_csv_employee defaults are the max
+    # job/department ids and the min hire_date, counted with CASE aggregates
+    max_job_id = select(func.max(Employee.job_id)).scalar_subquery()
+    max_department_id = select(func.max(Employee.department_id)).scalar_subquery()
+    min_hire_date = select(func.min(Employee.hire_date)).scalar_subquery()
+    name_is_null = or_(
+        Employee.name.is_(None),
+        func.lower(Employee.name) == "nan",
+        Employee.name.in_(["", "null"]),
+    )
+    return select(
+        max_job_id.label("max_job_id"),
+        max_department_id.label("max_department_id"),
+        min_hire_date.label("min_hire_date"),
+        func.count(case((Employee.job_id == max_job_id, 1))).label("job_id_count"),
+        func.count(case((Employee.department_id == max_department_id, 1))).label(
+            "department_id_count"
+        ),
+        func.count(case((name_is_null, 1))).label("name_null_count"),
+        (func.count() - func.count(Employee.job_id)).label("job_id_nulls"),
+        (func.count() - func.count(Employee.department_id)).label(
+            "department_id_nulls"
+        ),
+    ).select_from(Employee)
@@ -1,74 +1,54 @@
 # app/routes.py
-from flask import Blueprint, request, jsonify, current_app as app
-from .models import db, Department, Job, Employee
-import pandas as pd
+# the load, export and verification modules pull in pandas, pyarrow, boto3 and
+# friends, so they are imported by the views that use them and workers serving
+# only reports never load them
+from flask import Blueprint, Response, request, jsonify
+from .models import db, IngestJob
 import sqlalchemy.exc
-from sqlalchemy.exc import IntegrityError, OperationalError
-from pandas.testing import assert_frame_equal
-from sqlalchemy import text
-import psycopg2
+from sqlalchemy.exc import OperationalError
 import logging
-from .utils import pluralize, pluralize_columns, process_csv_employee
+from .loaders import ENGINES, LOAD_MODES, UPLOAD_ENGINE
+from .cache import (
+    reference_cache,
+    response_cache,
+    cached_response,
+    invalidates_cache,
+)
+from .fetch import s3_cache
+from .metrics import observe_request, render_metrics, start_request_timer
+from .replicas import read_only
+from .summary import backfill_hire_summary, rebuild_hire_summary
+from .reports import (
+    report1_query,
+    report2_query,
+    REPORT_YEAR,
+    REPORT1_COLUMNS,
+    REPORT2_COLUMNS,
+)
+from .streaming import stream_report, STREAM_FORMATS
 import os
 from datetime import datetime
-import numpy as np
 
 bp = Blueprint("routes", __name__)
+bp.before_app_request(start_request_timer)
+bp.after_app_request(observe_request)
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-S3_BUCKET = os.getenv("S3_BUCKET", "csv-api-employee-db")
-LOCAL_CSV_PATH = os.getenv("LOCAL_CSV_PATH", "csv_files")
 FLASK_ENV = os.getenv("FLASK_ENV", "testing")
 
 
 def run_integration_tests(source):
-    results_list = []
-    file_csv_name = ["departments", "jobs", "hired_employees"]
-    for csv_file in file_csv_name:
-        model = pluralize(csv_file)
-        logger.info(f"csv_file_name {csv_file}, model {model}")
-        with app.app_context():
-            query = db.session.query(model).statement
-            db_df = pd.read_sql(query, db.engine)
-
-            if source == "s3":
-                file_path = f"s3://{S3_BUCKET}/csv_files/{csv_file}.csv"
-            else:
-                file_path = f"{LOCAL_CSV_PATH}/{csv_file}.csv"
-            column_names = pluralize_columns(csv_file)
-            csv_df = pd.read_csv(file_path, delimiter=",", names=column_names)
-            if model == Employee:
-                csv_df = csv_df.reset_index()
-                csv_df = process_csv_employee(csv_df)
-                db_df["hire_date"] = pd.to_datetime(db_df["hire_date"])
-                db_df["name"] = db_df["name"].apply(
-                    lambda x: np.nan if pd.isna(x) or x.lower() == "nan" else x
-                )
-                csv_df["name"] = csv_df["name"].apply(
-                    lambda x: np.nan if pd.isna(x) or x.lower() == "nan" else x
-                )
-                db_df = db_df.replace(["", "null"], [np.nan, np.nan])
-            else:
-                csv_df.loc[len(csv_df)] = [len(csv_df) + 1, "not known"]
-            try:
-                assert_frame_equal(db_df, csv_df)
-                message = f"Los DataFrames del modelo {model} son iguales."
-                logger.info(message)
-                results_list.append({"message": message, "status": 200})
-            except AssertionError as e:
-                message = (
-                    f"Los DataFrames del modelo {model} son diferentes. Detalles: {e}"
-                )
-                logger.info(message)
-                results_list.append({"message": message, "status": 400})
-    return results_list
+    from .verify import verify_tables
+
+    return verify_tables(source)
 
 
 @bp.route("/run_integration_tests", methods=["GET"])
+@read_only
 def run_tests():
     source = request.args.get("source")
     if FLASK_ENV != "testing":
@@ -77,147 +57,249 @@ def run_tests():
     return jsonify(test_results), 200
 
 
+def upload_params_error(file_value, engine, chunksize, partitions, mode, run_async):
+    if not file_value or not any(
+        x in file_value for x in ["departments", "jobs", "employees"]
+    ):
+        return "El nombre del archivo no es válido. Debe contener 'departments', 'jobs' o 'employees'."
+    if engine not in ENGINES:
+        return (
+            f"El engine '{engine}' no es válido. Debe ser uno de: {', '.join(ENGINES)}."
+        )
+    if chunksize is not None and chunksize <= 0:
+        return "chunksize debe ser un entero positivo."
+    if partitions is not None and (partitions <= 0 or "employees" not in file_value):
+        return "parallel debe ser un entero positivo y solo aplica al archivo de employees."
+    if mode not in LOAD_MODES:
+        return (
+            f"El modo '{mode}' no es válido. Debe ser uno de: {', '.join(LOAD_MODES)}."
+        )
+    if partitions and mode != "insert":
+        return "parallel solo se puede usar con el modo insert."
+    if partitions and run_async:
+        return "parallel no se puede usar con async."
+    return None
+
+
+def body_params_error(body, partitions, mode, run_async):
+    if not body:
+        return None
+    if partitions or run_async:
+        return "Un csv enviado en el cuerpo de la petición no se puede cargar con parallel ni async."
+    if mode == "append":
+        return "El modo append necesita un archivo en source para guardar hasta dónde se cargó."
+    return None
+
+
 @bp.route("/upload_csv", methods=["POST"])
+@invalidates_cache
 def upload_csv():
+    from .ingest import ingest_file, ingest_file_parallel, describe_upload_error
+    from .jobs import submit_ingest_job
+    from .upload_body import csv_body, has_csv_body
+
     logger.info("request: %s", request)
     file_value = request.args.get("file")
     source = request.args.get("source")
     logger.info("file value: %s", file_value)
     logger.info("source: %s", source)
 
-    if not file_value or not any(
-        x in file_value for x in ["departments", "jobs", "employees"]
-    ):
+    engine = request.args.get("engine", UPLOAD_ENGINE)
+    chunksize = request.args.get("chunksize", type=int)
+    partitions = request.args.get("parallel", type=int)
+    mode = request.args.get("mode", "insert")
+    run_async = request.args.get("async") in ("1", "true")
+    body = has_csv_body(request)
+    error = upload_params_error(
+        file_value, engine, chunksize, partitions, mode, run_async
+    ) or body_params_error(body, partitions, mode, run_async)
+    if error:
+        return jsonify({"error": error}), 400
+
+    if run_async:
+        try:
+            job = submit_ingest_job(file_value, source, engine, chunksize, mode)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error: {e}")
+            payload, status = describe_upload_error(file_value, e)
+            return jsonify(payload), status
         return (
             jsonify(
                 {
-                    "error": "El nombre del archivo no es válido. Debe contener 'departments', 'jobs' o 'employees'."
+                    "job_id": job.id,
+                    "status": job.status,
+                    "status_url": f"/jobs/{job.id}",
                 }
             ),
-            400,
+            202,
         )
 
-    if source == "s3":
-        file_path = f"s3://{S3_BUCKET}/csv_files/{file_value}.csv"
-    else:
-        file_path = f"{LOCAL_CSV_PATH}/{file_value}.csv"
-
-    if "departments" in file_value:
-        df = pd.read_csv(file_path, delimiter=",", names=["id", "title"])
-        df.loc[len(df)] = [-1, "not known"]
-        logger.info("Loading rows: %s", df.shape)
-        for _, row in df.iterrows():
-            department = Department(name=row["title"])
-            db.session.add(department)
-    elif "jobs" in file_value:
-        df = pd.read_csv(file_path, delimiter=",", names=["id", "title"])
-        df.loc[len(df)] = [-1, "not known"]
-        logger.info("Loading rows: %s", df.shape)
-        for _, row in df.iterrows():
-            job = Job(title=row["title"])
-            db.session.add(job)
-    elif "employees" in file_value:
-        df = pd.read_csv(
-            file_path,
-            delimiter=",",
-            names=["name", "hire_date", "department_id", "job_id"],
+    try:
+        if partitions:
+            result = ingest_file_parallel(file_value, source, partitions)
+        else:
+            stream = csv_body(request) if body else None
+            result = ingest_file(
+                file_value, source, engine, chunksize, mode=mode, stream=stream
+            )
+        return jsonify(result), 200
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error: {e}")
+        payload, status = describe_upload_error(file_value, e)
+        return jsonify(payload), status
+
+
+@bp.route("/upload_batch", methods=["POST"])
+@invalidates_cache
+def upload_batch_files():
+    from .batch import BATCH_MODES, upload_batch
+    from .ingest import describe_upload_error
+    from .utils import csv_kind
+
+    manifest = request.get_json(silent=True)
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("files"), list):
+        return (
+            jsonify(
+                {
+                    "error": "El manifiesto debe ser un JSON con la lista de archivos en 'files'."
+                }
+            ),
+            400,
         )
-        df = process_csv_employee(df)
-        print("Loading rows: ", df.shape)
-        for _, row in df.iterrows():
-            employee = Employee(
-                name=row["name"],
-                job_id=row["job_id"],
-                department_id=row["department_id"],
-                hire_date=row["hire_date"],
+
+    files = []
+    for entry in manifest["files"]:
+        if isinstance(entry, str):
+            entry = {"file": entry}
+        file_value = entry.get("file") if isinstance(entry, dict) else None
+        if not isinstance(file_value, str) or not any(
+            x in file_value for x in ["departments", "jobs", "employees"]
+        ):
+            return (
+                jsonify(
+                    {
+                        "error": "El nombre del archivo no es válido. Debe contener 'departments', 'jobs' o 'employees'."
+                    }
+                ),
+                400,
             )
-            db.session.add(employee)
+        files.append((file_value, entry.get("source", manifest.get("source"))))
+    kinds = [csv_kind(file_value) for file_value, _ in files]
+    if not files or len(set(kinds)) != len(kinds):
+        return (
+            jsonify(
+                {
+                    "error": "El manifiesto debe incluir al menos un archivo y cada tabla una sola vez."
+                }
+            ),
+            400,
+        )
 
-    try:
-        db.session.commit()
-        logger.info(f"File {file_value} uploaded successfully")
-        return jsonify({"message": f"File {file_value} uploaded successfully"}), 200
-    except IntegrityError as e:
-        error_message = str(e)
-        db.session.rollback()
+    engine = manifest.get("engine", UPLOAD_ENGINE)
+    if engine not in ENGINES:
+        return (
+            jsonify(
+                {
+                    "error": f"El engine '{engine}' no es válido. Debe ser uno de: {', '.join(ENGINES)}."
+                }
+            ),
+            400,
+        )
+    mode = manifest.get("mode", "insert")
+    if mode not in BATCH_MODES:
         return (
             jsonify(
                 {
-                    "error": f"There is information that has been inserted already, the unique key contraint in the table {file_value} doens't allow to insert the same key",
-                    "detail": error_message,
+                    "error": f"El modo '{mode}' no es válido. Debe ser uno de: {', '.join(BATCH_MODES)}."
                 }
             ),
             400,
         )
 
-    except sqlalchemy.exc.ProgrammingError as e:
+    try:
+        return jsonify(upload_batch(files, engine, mode)), 200
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error: {e}")
+        payload, status = describe_upload_error("batch", e)
+        return jsonify(payload), status
+
+
+@bp.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    from .jobs import job_status
+
+    try:
+        job = db.session.get(IngestJob, job_id)
+    except (sqlalchemy.exc.ProgrammingError, OperationalError) as e:
         db.session.rollback()
         return (
             jsonify({"error": f"You must create the tables in the database first {e}"}),
             400,
         )
-    except Exception as e:
-        logger.error(f"Error: {e}")
-        return jsonify({"error": str(e)}), 500
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    return jsonify(job_status(job)), 200
+
+
+@bp.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return (
+        jsonify(
+            {
+                "reference_data": reference_cache.stats(),
+                "responses": response_cache.stats(),
+                "s3_files": s3_cache.stats(),
+            }
+        ),
+        200,
+    )
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    caches = {
+        "reference_data": reference_cache.stats(),
+        "responses": response_cache.stats(),
+        "s3_files": s3_cache.stats(),
+    }
+    return Response(render_metrics(caches), mimetype="text/plain; version=0.0.4")
+
+
+def report_filters():
+    return {
+        "year": request.args.get("year", REPORT_YEAR, type=int),
+        "department_id": request.args.get("department_id", type=int),
+        "job_id": request.args.get("job_id", type=int),
+        "live": request.args.get("live") in ("1", "true"),
+    }
 
 
 @bp.route("/generate_report1", methods=["GET"])
+@cached_response
+@read_only
 def generate_report1():
     logger.info("Generating report")
-    sql_query = """
-    WITH hired_employees AS (
-        SELECT
-            e.id AS employee_id,
-            e.name AS employee_name,
-            e.hire_date,
-            e.department_id,
-            e.job_id,
-            EXTRACT(quarter FROM e.hire_date) AS quarter
-        FROM employee e
-        WHERE EXTRACT(year FROM e.hire_date) = 2021
-    ),
-    job_names AS (
-        SELECT
-            j.id AS job_id,
-            j.title AS job_name
-        FROM job j
-    ),
-    department_names AS (
-        SELECT
-            d.id AS department_id,
-            d.name AS department_name
-        FROM department d
-    )
-    SELECT
-        dn.department_name AS department,
-        jn.job_name AS job,
-	COUNT(CASE WHEN he.quarter = 1 THEN he.employee_id END) AS Q1,
-    COUNT(CASE WHEN he.quarter = 2 THEN he.employee_id END) AS Q2,
-    COUNT(CASE WHEN he.quarter = 3 THEN he.employee_id END) AS Q3,
-    COUNT(CASE WHEN he.quarter = 4 THEN he.employee_id END) AS Q4
-    FROM hired_employees he
-    JOIN job_names jn ON he.job_id = jn.job_id
-    JOIN department_names dn ON he.department_id = dn.department_id
-    GROUP BY dn.department_name, jn.job_name, he.quarter
-    ORDER BY dn.department_name, jn.job_name;
-    """
-
-    try:
-        result = db.session.execute(text(sql_query))
-        logger.info("Generating result %s", result)
-        report_data = []
-        for row in result:
-            report_data.append(
+    query = report1_query(**report_filters())
+    output_format = request.args.get("format")
+    if output_format is not None and output_format not in STREAM_FORMATS:
+        return (
+            jsonify(
                 {
-                    "department": row[0],
-                    "job": row[1],
-                    "Q1": row[2],
-                    "Q2": row[3],
-                    "Q3": row[4],
-                    "Q4": row[5],
+                    "error": f"El formato '{output_format}' no es válido. Debe ser uno de: {', '.join(STREAM_FORMATS)}."
                 }
-            )
+            ),
+            400,
+        )
 
+    try:
+        if output_format:
+            return stream_report(query, REPORT1_COLUMNS, output_format)
+        result = db.session.execute(query)
+        logger.info("Generating result %s", result)
+        report_data = [dict(zip(REPORT1_COLUMNS, row)) for row in result]
         return jsonify(report_data), 200
     except OperationalError as e:
         db.session.rollback()
@@ -235,35 +317,27 @@ def generate_report1():
 
 
 @bp.route("/generate_report2", methods=["GET"])
+@cached_response
+@read_only
 def generate_report2():
-    print("Generating report")
-    sql_query = """
-    with count_hires_department as (
-    SELECT
-            d.id AS department_id,
-            d.name AS department,
-            COUNT(e.id) AS hired,
-        AVG(COUNT(e.id)) OVER () AS mean_hires_by_dept
-        FROM
-            department d
-        JOIN
-            employee e ON d.id = e.department_id
-        WHERE
-            EXTRACT(YEAR FROM e.hire_date) = 2021
-        GROUP BY
-            d.id, d.name)
-
-    select department_id, department,hired
-    from count_hires_department as count_hires
-    where mean_hires_by_dept < hired
-    ;
-    """
+    logger.info("Generating report")
+    query = report2_query(**report_filters())
+    output_format = request.args.get("format")
+    if output_format is not None and output_format not in STREAM_FORMATS:
+        return (
+            jsonify(
+                {
+                    "error": f"El formato '{output_format}' no es válido. Debe ser uno de: {', '.join(STREAM_FORMATS)}."
+                }
+            ),
+            400,
+        )
     try:
-        result = db.session.execute(text(sql_query))
+        if output_format:
+            return stream_report(query, REPORT2_COLUMNS, output_format)
+        result = db.session.execute(query)
         logger.info("Generating result %s", result)
-        report_data = []
-        for row in result:
-            report_data.append({"id": row[0], "deparment": row[1], "hired": row[2]})
+        report_data = [dict(zip(REPORT2_COLUMNS, row)) for row in result]
         return jsonify(report_data), 200
     except OperationalError as e:
         db.session.rollback()
@@ -280,78 +354,138 @@ def generate_report2():
         return jsonify({"error": str(e)}), 500
 
 
+@bp.route("/export/<table>", methods=["GET"])
+@read_only
+def export(table):
+    from .export import EXPORT_FORMATS, EXPORT_TABLES, export_table
+
+    if table not in EXPORT_TABLES:
+        return (
+            jsonify(
+                {
+                    "error": f"La tabla '{table}' no es válida. Debe ser una de: {', '.join(EXPORT_TABLES)}."
+                }
+            ),
+            400,
+        )
+    output_format = request.args.get("format", "parquet")
+    if output_format not in EXPORT_FORMATS:
+        return (
+            jsonify(
+                {
+                    "error": f"El formato '{output_format}' no es válido. Debe ser uno de: {', '.join(EXPORT_FORMATS)}."
+                }
+            ),
+            400,
+        )
+    table_columns = list(EXPORT_TABLES[table].__table__.columns.keys())
+    columns = request.args.get("columns")
+    columns = columns.split(",") if columns else table_columns
+    unknown = [column for column in columns if column not in table_columns]
+    if unknown:
+        return (
+            jsonify(
+                {
+                    "error": f"Columnas no válidas para {table}: {', '.join(unknown)}. Deben ser de: {', '.join(table_columns)}."
+                }
+            ),
+            400,
+        )
+    try:
+        hire_date_from = parse_date(request.args.get("hire_date_from"))
+        hire_date_to = parse_date(request.args.get("hire_date_to"))
+    except ValueError:
+        return (
+            jsonify({"error": "Las fechas deben tener el formato YYYY-MM-DD."}),
+            400,
+        )
+    if (hire_date_from or hire_date_to) and table != "employee":
+        return (
+            jsonify(
+                {"error": "El rango de hire_date solo aplica a la tabla employee."}
+            ),
+            400,
+        )
+    try:
+        return export_table(table, output_format, columns, hire_date_from, hire_date_to)
+    except OperationalError as e:
+        db.session.rollback()
+        logger.error("Error conecting to sqlite %s", e)
+        return jsonify({"error": f"Database operation error: {str(e)}"}), 500
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d") if value else None
+
+
+@bp.route("/refresh_summary", methods=["POST"])
+@invalidates_cache
+def refresh_summary():
+    try:
+        logger.info("reconstruyendo el resumen de contrataciones")
+        groups = rebuild_hire_summary()
+        db.session.commit()
+        return jsonify({"message": "Hire summary rebuilt", "groups": groups}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
 @bp.route("/recreate_tables", methods=["DELETE"])
+@invalidates_cache
 def recreate_tables():
     try:
         logger.info("recreando las tablas de la BD")
         db.drop_all()
         db.create_all()
+        reference_cache.invalidate()
         return jsonify({"message": "Tables recreated successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@bp.route("/reload_tables", methods=["POST"])
+@invalidates_cache
+def reload():
+    from .ingest import describe_upload_error
+    from .reload import reload_lock, reload_tables
+
+    source = request.args.get("source")
+    with reload_lock() as locked:
+        if not locked:
+            return jsonify({"error": "Ya hay una recarga de las tablas en curso."}), 409
+        try:
+            logger.info("recargando las tablas de la BD")
+            return jsonify(reload_tables(source)), 200
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error: {e}")
+            payload, status = describe_upload_error("tables", e)
+            return jsonify(payload), status
+
+
 @bp.route("/create_tables", methods=["POST"])
+@invalidates_cache
 def create_tables():
     try:
         logger.info("creando las tablas de la BD")
         db.create_all()
+        # fills the summary of databases loaded before it existed
+        backfill_hire_summary()
+        db.session.commit()
         return jsonify({"message": "Tables created successfully"}), 200
     except Exception as e:
+        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
 
-def null_report():
-    results_list = []
-    file_csv_name = ["departments", "jobs", "hired_employees"]
-    for csv_file in file_csv_name:
-        model = pluralize(csv_file)
-        logger.info(f"csv_file_name {csv_file}, model {model}")
-        with app.app_context():
-            query = db.session.query(model).statement
-            db_df = pd.read_sql(query, db.engine)
-            if model == Employee:
-                db_df["hire_date"] = pd.to_datetime(db_df["hire_date"])
-                db_df["name"] = db_df["name"].apply(
-                    lambda x: np.nan if pd.isna(x) or x.lower() == "nan" else x
-                )
-                db_df = db_df.replace(["", "null"], [np.nan, np.nan])
-                max_job_id = db_df["job_id"].max()
-                max_department_id = db_df["department_id"].max()
-                max_hire_date = db_df["hire_date"].min()
-                count_nulls_job_id = db_df["job_id"].value_counts().get(max_job_id, 0)
-                count_nulls_hire_date = (
-                    db_df["job_id"].value_counts().get(max_job_id, 0)
-                )
-                count_nulls_department_id = (
-                    db_df["department_id"].value_counts().get(max_department_id, 0)
-                )
-                nan_count_name = db_df["name"].isna().sum()
-                results_list.append(
-                    {
-                        "count_nulls_job_id": f"valor por defecto en la BD:{max_job_id}  conteo: {int(count_nulls_job_id)}",
-                        "count_nulls_department_id": f"valor por defecto en la BD: {max_department_id} conteo: {int(count_nulls_department_id)}",
-                        "nan_count_name": int(nan_count_name),
-                        "nan_hire_date": f"valor por defecto en BD {max_hire_date} conteo: {int(count_nulls_hire_date)}",
-                        "table": "Employees",
-                    }
-                )
-            elif model == Department:
-                db_df = db_df[db_df["name"] == "not known"]
-                json_result = db_df.to_json(orient="records")
-                results_list.append({"message": json_result, "table": "Department"})
-            else:
-                db_df = db_df[db_df["title"] == "not known"]
-                json_result = db_df.to_json(orient="records")
-                results_list.append({"message": json_result, "table": "Job"})
-
-    return results_list
-
-
 @bp.route("/run_null_report", methods=["GET"])
+@cached_response
+@read_only
 def run_null_report():
     if FLASK_ENV != "testing":
         return jsonify({"error": "Endpoint only available in testing environment"}), 403
+    from .null_report import null_report
+
     test_results = null_report()
-    print(test_results)
     return jsonify(test_results), 200
@@ -0,0 +1,59 @@
+import csv
+import io
+import os
+from flask import Response, current_app, stream_with_context
+from .models import db
+
+
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "json": "application/json",
+}
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+
+def execute_streaming(query):
+    # server-side cursor on PostgreSQL, rows are fetched in yield_per batches
+    return db.session.execute(
+        query.execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE)
+    )
+
+
+def ndjson_lines(result, columns):
+    for row in result:
+        yield current_app.json.dumps(dict(zip(columns, row))) + "\n"
+
+
+def json_array(result, columns):
+    yield "["
+    separator = ""
+    for row in result:
+        yield separator + current_app.json.dumps(dict(zip(columns, row)))
+        separator = ","
+    yield "]"
+
+
+def csv_lines(result, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in result.partitions():
+        for row in rows:
+            writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_report(query, columns, format):
+    # executed before the response starts so database errors still map to a status
+    result = execute_streaming(query)
+    if format == "ndjson":
+        body = ndjson_lines(result, columns)
+    elif format == "csv":
+        body = csv_lines(result, columns)
+    else:
+        body = json_array(result, columns)
+    return Response(stream_with_context(body), mimetype=STREAM_FORMATS[format])
@@ -0,0 +1,101 @@
+import logging
+from sqlalchemy import Integer, cast, delete, extract, func, select
+from .models import db, Employee, HireSummary
+from .loaders import dialect_insert
+from .reports import quarter_of
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def hires_by_quarter(employee=Employee.__table__):
+    year = cast(extract("year", employee.c.hire_date), Integer)
+    quarter = quarter_of(employee.c.hire_date)
+    # summary keys can not be null, unknown ids use the same -1 as process_csv_employee
+    department_id = func.coalesce(employee.c.department_id, -1)
+    job_id = func.coalesce(employee.c.job_id, -1)
+    query = (
+        select(
+            year.label("year"),
+            quarter.label("quarter"),
+            department_id.label("department_id"),
+            job_id.label("job_id"),
+            func.count(employee.c.id).label("hired"),
+        )
+        .where(employee.c.hire_date.isnot(None))
+        .group_by(year, quarter, department_id, job_id)
+    )
+    return query
+
+
+def hire_groups(df):
+    # counted from the rows a load inserted, not from the table: a concurrent load
+    # commits rows the other one must not count
+    df = df[df["hire_date"].notna()]
+    hire_date = df["hire_date"].dt
+    counts = df.groupby(
+        [
+            hire_date.year.rename("year"),
+            ((hire_date.month - 1) // 3 + 1).rename("quarter"),
+            df["department_id"].fillna(-1).astype("int64"),
+            df["job_id"].fillna(-1).astype("int64"),
+        ]
+    ).size()
+    return [
+        {
+            "year": int(year),
+            "quarter": int(quarter),
+            "department_id": int(department_id),
+            "job_id": int(job_id),
+            "hired": int(hired),
+        }
+        for (year, quarter, department_id, job_id), hired in counts.items()
+    ]
+
+
+def merge_groups(added, removed=()):
+    # one row per group: a statement can not update the same summary row twice
+    keys = ("year", "quarter", "department_id", "job_id")
+    hired = {}
+    for rows, sign in ((added, 1), (removed, -1)):
+        for row in rows:
+            key = tuple(row[k] for k in keys)
+            hired[key] = hired.get(key, 0) + sign * row["hired"]
+    return [dict(zip(keys, key), hired=n) for key, n in hired.items() if n]
+
+
+def table_hire_groups(employee):
+    return [
+        dict(row._mapping)
+        for row in db.session.execute(hires_by_quarter(employee=employee))
+    ]
+
+
+def refresh_hire_summary(rows):
+    if not rows:
+        return 0
+    statement = dialect_insert(HireSummary.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=["year", "quarter", "department_id", "job_id"],
+        set_={"hired": HireSummary.hired + statement.excluded.hired},
+    )
+    db.session.execute(statement, rows)
+    if any(row["hired"] < 0 for row in rows):
+        # groups left empty by updated rows
+        db.session.execute(delete(HireSummary).where(HireSummary.hired <= 0))
+    logger.info("Refreshed %s hire summary groups", len(rows))
+    return len(rows)
+
+
+def rebuild_hire_summary():
+    db.session.execute(delete(HireSummary))
+    return refresh_hire_summary(table_hire_groups(Employee.__table__))
+
+
+def backfill_hire_summary():
+    # databases loaded before the summary existed have employees and no summary
+    if db.session.query(HireSummary.year).first() is not None:
+        return 0
+    if db.session.query(Employee.id).first() is None:
+        return 0
+    return rebuild_hire_summary()
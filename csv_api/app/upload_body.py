@@ -0,0 +1,169 @@
+import io
+import os
+import zlib
+import zstandard
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+    NeedData,
+)
+
+
+# limit on the decompressed csv, compressed bodies are checked against it too
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(1024 * 1024 * 1024)))
+UPLOAD_READ_SIZE = 64 * 1024
+# rows parsed and committed at a time when the csv comes in the request body
+UPLOAD_BODY_CHUNKSIZE = int(os.getenv("UPLOAD_BODY_CHUNKSIZE", "50000"))
+BODY_MIMETYPES = {
+    "text/csv": None,
+    "text/plain": None,
+    "application/octet-stream": None,
+    "application/gzip": "gzip",
+    "application/x-gzip": "gzip",
+    "application/zstd": "zstd",
+}
+FILE_SUFFIXES = {".gz": "gzip", ".gzip": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+
+
+class UploadBodyError(ValueError):
+    pass
+
+
+def has_csv_body(request):
+    mimetype = request.mimetype
+    return mimetype in BODY_MIMETYPES or mimetype == "multipart/form-data"
+
+
+def read_blocks(stream):
+    while True:
+        block = stream.read(UPLOAD_READ_SIZE)
+        if not block:
+            return
+        yield block
+
+
+def limited(blocks, max_bytes):
+    total = 0
+    for block in blocks:
+        total += len(block)
+        if total > max_bytes:
+            raise RequestEntityTooLarge()
+        yield block
+
+
+def multipart_file(stream, boundary):
+    # first yields the (filename, content type) of the first file part, then its data
+    decoder = MultipartDecoder(boundary.encode(), max_form_memory_size=None)
+    in_file = found = False
+    for block in read_blocks(stream):
+        decoder.receive_data(block)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File) and not found:
+                in_file = found = True
+                yield event.filename, event.headers.get("Content-Type")
+            elif isinstance(event, (File, Field)):
+                in_file = False
+            elif isinstance(event, Data) and in_file:
+                yield event.data
+                if not event.more_data:
+                    return
+            event = decoder.next_event()
+        if isinstance(event, Epilogue):
+            break
+    if in_file:
+        raise UploadBodyError("El archivo del formulario está incompleto.")
+    if not found:
+        raise UploadBodyError("El formulario no contiene ningún archivo csv.")
+
+
+def gunzip(blocks):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    in_member = False
+    for block in blocks:
+        while block:
+            in_member = True
+            data = decompressor.decompress(block, UPLOAD_READ_SIZE)
+            block = decompressor.unconsumed_tail
+            if decompressor.eof:
+                # concatenated gzip members
+                block = decompressor.unused_data + block
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                in_member = False
+            yield data
+    if in_member:
+        raise UploadBodyError("El archivo gzip está incompleto.")
+
+
+def unzstd(blocks):
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        BlockReader(blocks), read_across_frames=True
+    )
+    return read_blocks(reader)
+
+
+def decompress(blocks, encoding):
+    try:
+        if encoding == "gzip":
+            yield from gunzip(blocks)
+        elif encoding == "zstd":
+            yield from unzstd(blocks)
+        elif encoding is None:
+            yield from blocks
+        else:
+            raise UploadBodyError(
+                f"La compresión '{encoding}' no es válida. Debe ser gzip o zstd."
+            )
+    except (zlib.error, zstandard.ZstdError) as e:
+        raise UploadBodyError(f"No se pudo descomprimir el archivo: {e}") from e
+
+
+class BlockReader(io.RawIOBase):
+    # file-like view over the body blocks; pandas pulls from it one chunk at a time,
+    # so the request is only read as fast as the rows are loaded
+    def __init__(self, blocks):
+        self.blocks = iter(blocks)
+        self.pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            self.pending = next(self.blocks, None)
+            if self.pending is None:
+                self.pending = b""
+                return 0
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def csv_body(request):
+    encoding = request.headers.get("Content-Encoding")
+    if request.mimetype == "multipart/form-data":
+        boundary = parse_options_header(request.content_type)[1].get("boundary")
+        if not boundary:
+            raise UploadBodyError("El formulario multipart no tiene boundary.")
+        parts = multipart_file(request.stream, boundary)
+        filename, content_type = next(parts)
+        suffix = os.path.splitext(filename or "")[1].lower()
+        encoding = (
+            encoding
+            or BODY_MIMETYPES.get(parse_options_header(content_type)[0])
+            or FILE_SUFFIXES.get(suffix)
+        )
+        blocks = parts
+    else:
+        encoding = encoding or BODY_MIMETYPES[request.mimetype]
+        blocks = read_blocks(request.stream)
+    blocks = decompress(limited(blocks, UPLOAD_MAX_BYTES), encoding)
+    return io.BufferedReader(
+        BlockReader(limited(blocks, UPLOAD_MAX_BYTES)), UPLOAD_READ_SIZE
+    )
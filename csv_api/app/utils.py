@@ -1,15 +1,82 @@
 from datetime import datetime
 import pandas as pd
 import logging
-import psycopg2
-from flask import jsonify
+import os
 import sqlalchemy.exc
 from .models import db, Department, Job, Employee
+from .cache import reference_cache, response_cache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+S3_BUCKET = os.getenv("S3_BUCKET", "csv-api-employee-db")
+LOCAL_CSV_PATH = os.getenv("LOCAL_CSV_PATH", "csv_files")
+# "pyarrow" parses with the Arrow CSV reader into Arrow-backed dtypes
+CSV_ENGINE = os.getenv("CSV_ENGINE", "c")
+
+CSV_SCHEMAS = {
+    "departments": ["id", "name"],
+    "jobs": ["id", "title"],
+    "hired_employees": ["id", "name", "hire_date", "department_id", "job_id"],
+}
+CSV_DTYPES = {
+    "id": "int64",
+    "name": str,
+    "title": str,
+    "hire_date": str,
+    # float64 parses much faster than the nullable Int64 in the C engine
+    "department_id": "float64",
+    "job_id": "float64",
+}
+
+
+def source_path(file_value, source):
+    if source == "s3":
+        return f"s3://{S3_BUCKET}/csv_files/{file_value}.csv"
+    return f"{LOCAL_CSV_PATH}/{file_value}.csv"
+
+
+def csv_kind(file_value):
+    if "departments" in file_value:
+        return "departments"
+    elif "jobs" in file_value:
+        return "jobs"
+    elif "employees" in file_value:
+        return "hired_employees"
+
+
+def csv_engine(chunksize=None):
+    # the Arrow reader has no chunked mode
+    if CSV_ENGINE != "pyarrow" or chunksize is not None:
+        return "c"
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        logger.warning("pyarrow is not installed, using the default CSV engine")
+        return "c"
+    return "pyarrow"
+
+
+def read_csv_file(file_path, file_value, chunksize=None):
+    names = CSV_SCHEMAS[csv_kind(file_value)]
+    engine = csv_engine(chunksize)
+    options = {
+        "delimiter": ",",
+        "names": names,
+        "chunksize": chunksize,
+    }
+    if engine == "pyarrow":
+        # pandas casts after the Arrow read, which costs more than the parse
+        # itself, so the Arrow reader keeps the types it infers
+        options.update(engine="pyarrow", dtype_backend="pyarrow")
+    else:
+        options["dtype"] = {name: CSV_DTYPES[name] for name in names}
+    if "id" in names and "hire_date" in names:
+        options["index_col"] = "id"
+    return pd.read_csv(file_path, **options)
+
+
 def pluralize(file):
     if file == "departments":
         return Department
@@ -19,21 +86,7 @@ def pluralize(file):
         return Employee
 
 
-def pluralize_columns(file):
-    if file == "departments":
-        return ["id", "name"]
-    elif file == "jobs":
-        return ["id", "title"]
-    elif file == "hired_employees":
-        return ["name", "hire_date", "department_id", "job_id"]
-    else:
-        return 0
-
-
-def process_csv_employee(csv_df):
-    csv_df = csv_df.reset_index()
-    csv_df = csv_df[["index", "name", "job_id", "department_id", "hire_date"]]
-    csv_df = csv_df.rename(columns={"index": "id"})
+def get_null_ids():
     try:
         deparment_query = Department.query.filter_by(name="not known").all()
         job_query = Job.query.filter_by(title="not known").all()
@@ -46,30 +99,51 @@ def process_csv_employee(csv_df):
         )
         nulls_deparment_id = default_null_value
         nulls_job_id = default_null_value
-    except psycopg2.errors.UndefinedTable as e:
-        db.session.rollback()
-        return (
-            jsonify({"error": f"You must create the tables in the database first {e}"}),
-            400,
-        )
-    except sqlalchemy.exc.ProgrammingError as e:
+    except sqlalchemy.exc.ProgrammingError:
         db.session.rollback()
-        return (
-            jsonify({"error": f"You must create the tables in the database first {e}"}),
-            400,
-        )
-    csv_df["job_id"] = csv_df["job_id"].fillna(nulls_job_id).astype(int)
+        raise
+    return nulls_deparment_id, nulls_job_id
 
-    csv_df["department_id"] = (
-        csv_df["department_id"].fillna(nulls_deparment_id).astype(int)
+
+def shared_version():
+    # in a savepoint, a database without the data_version table must not abort
+    # the transaction of the load asking for the ids
+    try:
+        with db.session.begin_nested():
+            return response_cache.data_version()
+    except (sqlalchemy.exc.ProgrammingError, sqlalchemy.exc.OperationalError):
+        return None
+
+
+def sentinel_ids():
+    version = shared_version()
+    if version is None:
+        return get_null_ids()
+    # keyed by database so apps bound to different databases never share entries,
+    # and by the data version so a write from any process invalidates them
+    return reference_cache.get_or_load(
+        (str(db.engine.url), version, "sentinel_ids"),
+        get_null_ids,
+        # the -1 fallback must not outlive the departments/jobs upload
+        cache_if=lambda ids: -1 not in ids,
     )
 
-    csv_df["hire_date"] = pd.to_datetime(csv_df["hire_date"]).dt.strftime(
-        "%Y-%m-%d %H:%M:%S"
+
+def process_csv_employee(csv_df, null_ids=None):
+    # the csv row id is the index, named or not depending on how it was read
+    csv_df = csv_df.rename_axis("id").reset_index()
+    csv_df = csv_df[["id", "name", "job_id", "department_id", "hire_date"]]
+    nulls_deparment_id, nulls_job_id = null_ids or sentinel_ids()
+    csv_df["job_id"] = csv_df["job_id"].fillna(nulls_job_id).astype("int64")
+
+    csv_df["department_id"] = (
+        csv_df["department_id"].fillna(nulls_deparment_id).astype("int64")
     )
-    csv_df["hire_date"] = pd.to_datetime(
-        csv_df["hire_date"].fillna(datetime(1970, 1, 1))
+
+    # a single ISO-8601 parse, kept as naive UTC wall time in whole seconds
+    hire_date = pd.to_datetime(csv_df["hire_date"], format="ISO8601", utc=True)
+    csv_df["hire_date"] = (
+        hire_date.dt.tz_localize(None).dt.floor("s").fillna(datetime(1970, 1, 1))
     )
-    csv_df["hire_date"] = pd.to_datetime(csv_df["hire_date"])
-    csv_df["name"] = csv_df["name"].astype(str)
+    csv_df["name"] = csv_df["name"].fillna("nan").astype(str)
     return csv_df
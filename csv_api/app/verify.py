@@ -0,0 +1,188 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from flask import current_app
+from sqlalchemy import String, and_, case, cast, func, or_, select
+from .fetch import fetch_source
+from .models import db, Department, Job, Employee
+from .replicas import current_replica, use_replica
+from .utils import pluralize, process_csv_employee, read_csv_file, source_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+VERIFY_CHUNKSIZE = int(os.getenv("VERIFY_CHUNKSIZE", "50000"))
+MAX_REPORTED_IDS = 100
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+TABLE_COLUMNS = {
+    Department: ["id", "name"],
+    Job: ["id", "title"],
+    Employee: ["id", "name", "job_id", "department_id", "hire_date"],
+}
+
+
+def normalize_name(value):
+    # "nan", "null" and "" are how missing names end up stored
+    if value is None or value != value:
+        return ""
+    if value.lower() == "nan" or value in ("", "null"):
+        return ""
+    return value
+
+
+def canonical_value(column, value):
+    if column == "name" and value is not None:
+        return normalize_name(value)
+    if value is None or value != value:
+        return ""
+    if column == "hire_date":
+        return value.strftime(DATE_FORMAT)
+    return str(value)
+
+
+def row_hash(columns, values):
+    text = "|".join(canonical_value(c, v) for c, v in zip(columns, values))
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def digest_add(digest, row_md5):
+    # order independent table digest: sum of 64 bit row hashes
+    return (digest + int(row_md5[:16], 16)) % (1 << 64)
+
+
+def sql_row_hash(model):
+    parts = []
+    for column_name in TABLE_COLUMNS[model]:
+        column = getattr(model, column_name)
+        if column_name == "name":
+            value = case(
+                (
+                    or_(
+                        column.is_(None),
+                        func.lower(column) == "nan",
+                        column.in_(["", "null"]),
+                    ),
+                    "",
+                ),
+                else_=column,
+            )
+        elif column_name == "hire_date":
+            value = func.to_char(column, "YYYY-MM-DD HH24:MI:SS")
+        else:
+            value = cast(column, String)
+        parts.append(func.coalesce(value, ""))
+    return func.md5(func.concat_ws("|", *parts))
+
+
+def db_hashes(model, low, high):
+    columns = TABLE_COLUMNS[model]
+    condition = and_(model.id >= low, model.id <= high)
+    if db.session.get_bind().dialect.name == "postgresql":
+        query = select(model.id, sql_row_hash(model)).where(condition)
+        return dict(db.session.execute(query).all())
+    query = select(*[getattr(model, c) for c in columns]).where(condition)
+    return {row[0]: row_hash(columns, row) for row in db.session.execute(query)}
+
+
+def csv_chunks(csv_file, source):
+    file_path = fetch_source(source_path(csv_file, source))
+    model = pluralize(csv_file)
+    reader = read_csv_file(file_path, csv_file, chunksize=VERIFY_CHUNKSIZE)
+    rows = 0
+    for chunk in reader:
+        if model == Employee:
+            chunk = process_csv_employee(chunk)
+        rows += len(chunk)
+        yield chunk
+    if model != Employee:
+        column = TABLE_COLUMNS[model][1]
+        # keyed loads store the "not known" row with SENTINEL_ID, the others
+        # after the last csv id
+        sentinel_id = db.session.execute(
+            select(model.id).where(getattr(model, column) == "not known")
+        ).scalar()
+        if sentinel_id is None:
+            sentinel_id = rows + 1
+        yield pd.DataFrame({"id": [sentinel_id], column: ["not known"]})
+
+
+def verify_table(csv_file, source):
+    model = pluralize(csv_file)
+    columns = TABLE_COLUMNS[model]
+    csv_digest = 0
+    db_digest = 0
+    csv_rows = 0
+    db_rows = 0
+    mismatched_ids = []
+    mismatched_ranges = []
+    mismatches = 0
+
+    # ids are compared chunk by chunk, so memory is bounded by the chunk size;
+    # chunk id ranges assume the file is ordered by id as the loaders write it
+    for chunk in csv_chunks(csv_file, source):
+        expected = {
+            row[0]: row_hash(columns, row)
+            for row in chunk[columns].itertuples(index=False, name=None)
+        }
+        low, high = min(expected), max(expected)
+        actual = db_hashes(model, low, high)
+        csv_rows += len(expected)
+        db_rows += len(actual)
+        for value in expected.values():
+            csv_digest = digest_add(csv_digest, value)
+        for value in actual.values():
+            db_digest = digest_add(db_digest, value)
+
+        different = [
+            row_id
+            for row_id in expected.keys() | actual.keys()
+            if expected.get(row_id) != actual.get(row_id)
+        ]
+        if different:
+            mismatches += len(different)
+            mismatched_ranges.append([int(low), int(high)])
+            room = MAX_REPORTED_IDS - len(mismatched_ids)
+            mismatched_ids.extend(int(i) for i in sorted(different)[:room])
+
+    total_db_rows = db.session.query(func.count(model.id)).scalar()
+    extra_db_rows = total_db_rows - db_rows
+    status = 200 if mismatches == 0 and extra_db_rows == 0 else 400
+    if status == 200:
+        message = f"Los DataFrames del modelo {model} son iguales."
+    else:
+        message = (
+            f"Los DataFrames del modelo {model} son diferentes. Detalles: "
+            f"{mismatches} filas distintas, {extra_db_rows} filas de la BD fuera del csv"
+        )
+    logger.info(message)
+    return {
+        "message": message,
+        "status": status,
+        "csv_rows": csv_rows,
+        "db_rows": total_db_rows,
+        "csv_digest": f"{csv_digest:016x}",
+        "db_digest": f"{db_digest:016x}",
+        "mismatched_ids": mismatched_ids,
+        "mismatched_ranges": mismatched_ranges,
+    }
+
+
+def verify_table_in_context(app, csv_file, source, replica):
+    with app.app_context():
+        use_replica(replica)
+        return verify_table(csv_file, source)
+
+
+def verify_tables(source, csv_files=("departments", "jobs", "hired_employees")):
+    app = current_app._get_current_object()
+    replica = current_replica()
+    with ThreadPoolExecutor(max_workers=len(csv_files)) as pool:
+        futures = [
+            pool.submit(verify_table_in_context, app, csv_file, source, replica)
+            for csv_file in csv_files
+        ]
+        return [future.result() for future in futures]
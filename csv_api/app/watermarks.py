@@ -0,0 +1,59 @@
+import hashlib
+import logging
+import os
+from datetime import datetime
+import fsspec
+from fsspec.core import url_to_fs
+from .fetch import object_version
+from .models import db, LoadWatermark
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# bytes before the watermark offset that must be unchanged to resume an append
+WATERMARK_TAIL_BYTES = int(os.getenv("WATERMARK_TAIL_BYTES", "4096"))
+
+
+def file_version(file_path):
+    if file_path.startswith("s3://"):
+        return object_version(file_path)
+    fs, path = url_to_fs(file_path)
+    info = fs.info(path)
+    return f"{info.get('mtime')}-{info['size']}", info["size"]
+
+
+def tail_checksum(file_path, end):
+    with fsspec.open(file_path, "rb") as f:
+        f.seek(max(end - WATERMARK_TAIL_BYTES, 0))
+        data = f.read(end - f.tell())
+    return hashlib.md5(data).hexdigest()
+
+
+def get_watermark(file_path):
+    return db.session.get(LoadWatermark, file_path)
+
+
+def resume_offset(watermark, local_path, size):
+    # an append resumes after the last loaded byte only while the file keeps
+    # its previous content; a shorter or rewritten file is read again
+    if watermark is None or watermark.byte_offset > size:
+        return 0
+    if tail_checksum(local_path, watermark.byte_offset) != watermark.checksum:
+        logger.info(
+            "%s was rewritten since the last load, reading it again", local_path
+        )
+        return 0
+    return watermark.byte_offset
+
+
+def save_watermark(file_path, local_path, version, size, rows, mode):
+    watermark = get_watermark(file_path) or LoadWatermark(source_path=file_path)
+    watermark.version = version
+    watermark.byte_offset = size
+    watermark.rows = rows
+    watermark.checksum = tail_checksum(local_path, size)
+    watermark.mode = mode
+    watermark.loaded_at = datetime.utcnow()
+    db.session.add(watermark)
+    return watermark
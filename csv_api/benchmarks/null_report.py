@@ -0,0 +1,130 @@
+# Compares the pandas null report with the SQL aggregate version.
+#
+#   python -m benchmarks.null_report --rows 1000000
+import argparse
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from flask import Flask
+from sqlalchemy import insert
+from app.models import db, Department, Job, Employee
+from app.null_report import null_report
+from app.routes import bp
+
+
+def legacy_null_report():
+    results_list = []
+    for model in [Department, Job, Employee]:
+        query = db.session.query(model).statement
+        db_df = pd.read_sql(query, db.engine)
+        if model == Employee:
+            db_df["hire_date"] = pd.to_datetime(db_df["hire_date"])
+            db_df["name"] = db_df["name"].apply(
+                lambda x: np.nan if pd.isna(x) or x.lower() == "nan" else x
+            )
+            db_df = db_df.replace(["", "null"], [np.nan, np.nan])
+            max_job_id = db_df["job_id"].max()
+            max_department_id = db_df["department_id"].max()
+            max_hire_date = db_df["hire_date"].min()
+            count_nulls_job_id = db_df["job_id"].value_counts().get(max_job_id, 0)
+            count_nulls_hire_date = db_df["job_id"].value_counts().get(max_job_id, 0)
+            count_nulls_department_id = (
+                db_df["department_id"].value_counts().get(max_department_id, 0)
+            )
+            nan_count_name = db_df["name"].isna().sum()
+            results_list.append(
+                {
+                    "count_nulls_job_id": f"valor por defecto en la BD:{max_job_id}  conteo: {int(count_nulls_job_id)}",
+                    "count_nulls_department_id": f"valor por defecto en la BD: {max_department_id} conteo: {int(count_nulls_department_id)}",
+                    "nan_count_name": int(nan_count_name),
+                    "nan_hire_date": f"valor por defecto en BD {max_hire_date} conteo: {int(count_nulls_hire_date)}",
+                    "table": "Employees",
+                }
+            )
+        elif model == Department:
+            db_df = db_df[db_df["name"] == "not known"]
+            json_result = db_df.to_json(orient="records")
+            results_list.append({"message": json_result, "table": "Department"})
+        else:
+            db_df = db_df[db_df["title"] == "not known"]
+            json_result = db_df.to_json(orient="records")
+            results_list.append({"message": json_result, "table": "Job"})
+    return results_list
+
+
+def populate(rows, batch_size=50000):
+    db.session.execute(
+        insert(Department.__table__),
+        [{"name": f"department {i}"} for i in range(12)] + [{"name": "not known"}],
+    )
+    db.session.execute(
+        insert(Job.__table__),
+        [{"title": f"job {i}"} for i in range(183)] + [{"title": "not known"}],
+    )
+    rng = random.Random(42)
+    start = datetime(2021, 1, 1)
+    for offset in range(0, rows, batch_size):
+        db.session.execute(
+            insert(Employee.__table__),
+            [
+                {
+                    "name": "nan" if rng.random() < 0.01 else f"employee {i}",
+                    "job_id": 184 if rng.random() < 0.01 else rng.randint(1, 183),
+                    "department_id": 13 if rng.random() < 0.01 else rng.randint(1, 12),
+                    "hire_date": (
+                        datetime(1970, 1, 1)
+                        if rng.random() < 0.01
+                        else start + timedelta(minutes=rng.randint(0, 525600))
+                    ),
+                }
+                for i in range(offset, min(offset + batch_size, rows))
+            ],
+        )
+    db.session.commit()
+
+
+def measure(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    db_fd, db_path = tempfile.mkstemp(suffix=".db")
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.database_url or f"sqlite:///{db_path}"
+    db.init_app(app)
+    app.register_blueprint(bp)
+    try:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            populate(args.rows)
+
+            new_result, new_seconds = measure(null_report)
+            new_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            old_result, old_seconds = measure(legacy_null_report)
+            old_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+    print(f"rows: {args.rows}")
+    print(f"pandas: {old_seconds:.3f}s  peak rss {old_rss:.1f} MB")
+    print(f"sql:    {new_seconds:.3f}s  peak rss {new_rss:.1f} MB")
+    print(f"speedup: {old_seconds / new_seconds:.1f}x")
+    print(f"same result: {old_result == new_result}")
+
+
+if __name__ == "__main__":
+    main()
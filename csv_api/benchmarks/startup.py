@@ -0,0 +1,83 @@
+# Import cost of starting the app, measured with python -X importtime in a fresh
+# interpreter for each run.
+#
+#   python -m benchmarks.startup [--runs 5] [--top 15]
+#   python -m benchmarks.startup --statement "import app.ingest"
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+STARTUP_STATEMENT = (
+    "from app import create_app; create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})"
+)
+# loaded on first use by the views that need them
+HEAVY_MODULES = (
+    "pandas",
+    "numpy",
+    "pyarrow",
+    "psycopg2",
+    "boto3",
+    "botocore",
+    "fsspec",
+    "s3fs",
+    "zstandard",
+)
+# sum of the top level imports, checked by the test suite
+STARTUP_TARGET_SECONDS = 1.2
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_profile(statement=STARTUP_STATEMENT):
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    wall = time.perf_counter() - start
+    modules = {}
+    total = 0
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        top_level = not name[1:].startswith(" ")
+        name = name.strip()
+        modules[name] = (int(self_us), int(cumulative_us))
+        if top_level:
+            total += int(cumulative_us)
+    return {"seconds": total / 1e6, "wall_seconds": wall, "modules": modules}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--statement", default=STARTUP_STATEMENT)
+    args = parser.parse_args()
+
+    profiles = [import_profile(args.statement) for _ in range(args.runs)]
+    seconds = [profile["seconds"] for profile in profiles]
+    wall = [profile["wall_seconds"] for profile in profiles]
+    print(
+        f"imports  p50 {statistics.median(seconds):.3f}s  min {min(seconds):.3f}s  "
+        f"(target {STARTUP_TARGET_SECONDS:.1f}s)"
+    )
+    print(f"process  p50 {statistics.median(wall):.3f}s  min {min(wall):.3f}s")
+
+    fastest = min(profiles, key=lambda profile: profile["seconds"])
+    loaded = [name for name in HEAVY_MODULES if name in fastest["modules"]]
+    print(f"heavy modules loaded: {', '.join(loaded) or 'none'}")
+    print(f"slowest imports by own time (of {len(fastest['modules'])}):")
+    ranked = sorted(fastest["modules"].items(), key=lambda item: -item[1][0])
+    for name, (self_us, cumulative_us) in ranked[: args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {cumulative_us / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
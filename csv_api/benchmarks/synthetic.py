@@ -0,0 +1,80 @@
+# Synthetic csv files shaped like the ones in csv_files/.
+#
+#   python -m benchmarks.synthetic --rows 2000000 --out /tmp/hired_employees.csv
+#   python -m benchmarks.synthetic --rows 1000000 --dataset /tmp/csv_files
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+
+# share of empty fields per column, close to the bundled sample
+NULL_RATIOS = {"name": 0.01, "hire_date": 0.01, "department_id": 0.01, "job_id": 0.01}
+DEPARTMENTS = 12
+JOBS = 183
+
+
+def hired_employees_frame(rows, seed=42, start_id=1):
+    rng = np.random.default_rng(seed)
+    seconds = rng.integers(0, 3 * 365 * 24 * 3600, rows)
+    hire_date = (
+        pd.Timestamp("2020-01-01") + pd.to_timedelta(seconds, unit="s")
+    ).strftime("%Y-%m-%dT%H:%M:%SZ")
+    df = pd.DataFrame(
+        {
+            "id": np.arange(start_id, start_id + rows),
+            "name": pd.Series(np.arange(rows)).map("Employee {}".format),
+            "hire_date": hire_date,
+            "department_id": rng.integers(1, DEPARTMENTS + 1, rows),
+            "job_id": rng.integers(1, JOBS + 1, rows),
+        }
+    )
+    for column, ratio in NULL_RATIOS.items():
+        df[column] = df[column].astype(object).mask(rng.random(rows) < ratio)
+    return df
+
+
+def write_hired_employees(path, rows, seed=42, batch_size=1_000_000):
+    with open(path, "w") as f:
+        for offset in range(0, rows, batch_size):
+            frame = hired_employees_frame(
+                min(batch_size, rows - offset), seed + offset, start_id=offset + 1
+            )
+            frame.to_csv(f, header=False, index=False)
+    return path
+
+
+def write_reference(path, prefix, rows):
+    frame = pd.DataFrame(
+        {"id": np.arange(1, rows + 1), "name": [f"{prefix} {i}" for i in range(rows)]}
+    )
+    frame.to_csv(path, header=False, index=False)
+    return path
+
+
+def write_dataset(directory, rows, seed=42):
+    # departments.csv, jobs.csv and hired_employees.csv, laid out like csv_files/
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "departments.csv")
+    write_reference(path, "Department", DEPARTMENTS)
+    write_reference(os.path.join(directory, "jobs.csv"), "Job", JOBS)
+    write_hired_employees(os.path.join(directory, "hired_employees.csv"), rows, seed)
+    return directory
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--out", default="hired_employees.csv")
+    parser.add_argument("--dataset", help="directory for all three csv files")
+    args = parser.parse_args()
+    if args.dataset:
+        write_dataset(args.dataset, args.rows)
+        print(f"wrote {args.rows} employees to {args.dataset}")
+        return
+    write_hired_employees(args.out, args.rows)
+    print(f"wrote {args.rows} rows to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# Parse + transform time and memory of hired_employees.csv, before and after the
+# typed read_csv_file/process_csv_employee pipeline.
+#
+#   python -m benchmarks.transform --rows 2000000 [--engine pyarrow]
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pandas as pd
+from app import utils
+from app.utils import process_csv_employee, read_csv_file
+from benchmarks.synthetic import write_hired_employees
+
+
+NULL_IDS = (13, 184)
+
+
+def legacy_process_csv_employee(csv_df, null_ids):
+    csv_df = csv_df.reset_index()
+    csv_df = csv_df[["index", "name", "job_id", "department_id", "hire_date"]]
+    csv_df = csv_df.rename(columns={"index": "id"})
+    nulls_deparment_id, nulls_job_id = null_ids
+    csv_df["job_id"] = csv_df["job_id"].fillna(nulls_job_id).astype(int)
+    csv_df["department_id"] = (
+        csv_df["department_id"].fillna(nulls_deparment_id).astype(int)
+    )
+    csv_df["hire_date"] = pd.to_datetime(csv_df["hire_date"]).dt.strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+    csv_df["hire_date"] = pd.to_datetime(
+        csv_df["hire_date"].fillna(datetime(1970, 1, 1))
+    )
+    csv_df["hire_date"] = pd.to_datetime(csv_df["hire_date"])
+    csv_df["name"] = csv_df["name"].astype(str)
+    return csv_df
+
+
+def legacy(path):
+    df = pd.read_csv(
+        path, delimiter=",", names=["name", "hire_date", "department_id", "job_id"]
+    )
+    return legacy_process_csv_employee(df, NULL_IDS)
+
+
+def current(path):
+    return process_csv_employee(read_csv_file(path, "hired_employees"), NULL_IDS)
+
+
+def run(name, path, engine):
+    utils.CSV_ENGINE = engine
+    function = legacy if name == "legacy" else current
+    start = time.perf_counter()
+    df = function(path)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    df = df.assign(hire_date=df["hire_date"].astype("int64"))
+    digest = int(pd.util.hash_pandas_object(df.astype(str), index=False).sum())
+    return elapsed, peak, digest, len(df)
+
+
+def measure(name, path, engine):
+    # a fresh process per run so peak RSS belongs to that pipeline only
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run, name, path, engine).result()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--engine", choices=["c", "pyarrow"], default="c")
+    parser.add_argument("--file", help="existing hired_employees.csv to use")
+    args = parser.parse_args()
+
+    if args.file:
+        path = args.file
+    else:
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+    try:
+        if not args.file:
+            write_hired_employees(path, args.rows)
+        old_seconds, old_peak, old_digest, rows = measure("legacy", path, args.engine)
+        new_seconds, new_peak, new_digest, _ = measure("current", path, args.engine)
+    finally:
+        if not args.file:
+            os.unlink(path)
+
+    print(f"rows: {rows}  engine: {args.engine}")
+    print(f"before: {old_seconds:.2f}s  peak rss {old_peak:.0f} MB")
+    print(f"after:  {new_seconds:.2f}s  peak rss {new_peak:.0f} MB")
+    print(f"speedup: {old_seconds / new_seconds:.1f}x")
+    print(f"same values: {old_digest == new_digest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""data version
+
+Revision ID: c38f5d9f3f88
+Revises: 42f4b6b107e6
+Create Date: 2026-10-18 16:14:38.099799
+
+"""
+
+import uuid
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c38f5d9f3f88"
+down_revision = "42f4b6b107e6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    data_version = op.create_table(
+        "data_version",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("version", sa.String(length=32), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.bulk_insert(data_version, [{"id": 1, "version": uuid.uuid4().hex}])
+
+
+def downgrade():
+    op.drop_table("data_version")
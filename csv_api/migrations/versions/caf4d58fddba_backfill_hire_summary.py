@@ -0,0 +1,60 @@
+"""backfill hire summary
+
+Revision ID: caf4d58fddba
+Revises: c38f5d9f3f88
+Create Date: 2026-10-18 16:16:29.822475
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "caf4d58fddba"
+down_revision = "c38f5d9f3f88"
+branch_labels = None
+depends_on = None
+
+
+employee = sa.table(
+    "employee",
+    sa.column("id", sa.Integer),
+    sa.column("job_id", sa.Integer),
+    sa.column("department_id", sa.Integer),
+    sa.column("hire_date", sa.DateTime),
+)
+hire_summary = sa.table(
+    "hire_summary",
+    sa.column("year", sa.Integer),
+    sa.column("quarter", sa.Integer),
+    sa.column("department_id", sa.Integer),
+    sa.column("job_id", sa.Integer),
+    sa.column("hired", sa.Integer),
+)
+
+
+def upgrade():
+    # databases loaded before the summary existed have employees and no summary
+    connection = op.get_bind()
+    if connection.execute(sa.select(hire_summary.c.year).limit(1)).first():
+        return
+    year = sa.cast(sa.extract("year", employee.c.hire_date), sa.Integer)
+    month = sa.cast(sa.extract("month", employee.c.hire_date), sa.Integer)
+    quarter = sa.case((month <= 3, 1), (month <= 6, 2), (month <= 9, 3), else_=4)
+    department_id = sa.func.coalesce(employee.c.department_id, -1)
+    job_id = sa.func.coalesce(employee.c.job_id, -1)
+    hires = (
+        sa.select(year, quarter, department_id, job_id, sa.func.count(employee.c.id))
+        .where(employee.c.hire_date.isnot(None))
+        .group_by(year, quarter, department_id, job_id)
+    )
+    connection.execute(
+        hire_summary.insert().from_select(
+            ["year", "quarter", "department_id", "job_id", "hired"], hires
+        )
+    )
+
+
+def downgrade():
+    pass
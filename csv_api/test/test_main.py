@@ -4,10 +4,49 @@ import tempfile
 import pytest
 from flask import Flask
 from app.routes import bp
-from app.models import db, Department, Job, Employee
+from app.models import db, Department, Job, Employee, HireSummary
+from app.parallel import split_byte_ranges
+from app.cache import reference_cache
+from app.fetch import (
+    FileCache,
+    LocalBucket,
+    ObjectChanged,
+    S3Bucket,
+    fetch_object,
+    get_bucket,
+)
+from app import (
+    batch,
+    cache,
+    coalesce,
+    export,
+    fetch,
+    ingest,
+    loaders,
+    reload,
+    routes,
+    summary,
+    upload_body,
+)
+from app.coalesce import QueryLimiter
+from benchmarks.startup import HEAVY_MODULES, STARTUP_TARGET_SECONDS, import_profile
+from app.utils import sentinel_ids
+from app.reports import report1_query
+from sqlalchemy import create_engine, text
 import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
 from moto import mock_aws
-from datetime import date
+import csv
+import gzip
+import io
+import json
+import resource
+import threading
+import time
+import zstandard
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
 
 
 @pytest.fixture
@@ -42,21 +81,516 @@ def test_upload_csv_departments(client):
     data = {"file": "departments"}
     response = client.post("/upload_csv", query_string=data)
     assert response.status_code == 200
-    assert response.json == {"message": "File departments uploaded successfully"}
+    assert response.json["message"] == "File departments uploaded successfully"
 
 
 def test_upload_csv_jobs(client):
     data = {"file": "jobs"}
     response = client.post("/upload_csv", query_string=data)
     assert response.status_code == 200
-    assert response.json == {"message": "File jobs uploaded successfully"}
+    assert response.json["message"] == "File jobs uploaded successfully"
 
 
 def test_upload_csv_employees(client):
     data = {"file": "hired_employees"}
     response = client.post("/upload_csv", query_string=data)
     assert response.status_code == 200
-    assert response.json == {"message": "File hired_employees uploaded successfully"}
+    assert response.json["message"] == "File hired_employees uploaded successfully"
+
+
+@pytest.mark.parametrize("engine", ["copy", "batch", "orm"])
+def test_upload_csv_employees_engines(client, app, engine):
+    data = {"file": "hired_employees", "engine": engine}
+    response = client.post("/upload_csv", query_string=data)
+    assert response.status_code == 200
+    assert response.json["engine"] == ("batch" if engine == "copy" else engine)
+    assert response.json["rows"] == 1999
+    assert response.json["rows_per_sec"] > 0
+    with app.app_context():
+        assert Employee.query.count() == 2000
+
+
+def test_upload_csv_invalid_engine(client):
+    data = {"file": "jobs", "engine": "bulk"}
+    response = client.post("/upload_csv", query_string=data)
+    assert response.status_code == 400
+
+
+def test_upload_csv_employees_chunked(client, app):
+    data = {"file": "hired_employees", "chunksize": 500}
+    response = client.post("/upload_csv", query_string=data)
+    assert response.status_code == 200
+    assert response.json["chunks"] == 4
+    assert response.json["rows"] == 1999
+    assert response.json["peak_memory_mb"] > 0
+    with app.app_context():
+        assert Employee.query.count() == 2000
+
+
+def test_upload_peak_memory_is_measured_per_upload(client):
+    # a larger allocation freed before the upload stays in the process peak
+    data = b"x" * (256 << 20)
+    del data
+    process_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    response = client.post(
+        "/upload_csv", query_string={"file": "hired_employees", "chunksize": 500}
+    )
+    assert 0 < response.json["peak_memory_mb"] < process_peak - 200
+
+
+def test_upload_csv_departments_chunked(client, app):
+    data = {"file": "departments", "chunksize": 5}
+    response = client.post("/upload_csv", query_string=data)
+    assert response.status_code == 200
+    assert response.json["chunks"] == 4
+    assert response.json["rows"] == 13
+    with app.app_context():
+        names = [d.name for d in Department.query.order_by(Department.id)]
+        assert names[-1] == "not known"
+
+
+def test_upload_csv_upsert_skips_unchanged_files(client, app):
+    data = {"file": "departments", "mode": "upsert"}
+    response = client.post("/upload_csv", query_string=data)
+    assert response.status_code == 200
+    assert response.json["skipped"] is False
+    response = client.post("/upload_csv", query_string=data)
+    assert response.status_code == 200
+    assert response.json["skipped"] is True
+    assert response.json["rows"] == 0
+    with app.app_context():
+        assert Department.query.count() == 13
+        assert Department.query.filter_by(name="not known").count() == 1
+
+    data = {"file": "departments", "mode": "merge"}
+    assert client.post("/upload_csv", query_string=data).status_code == 400
+
+
+def test_upload_csv_append_loads_only_new_rows(client, app, tmp_path, monkeypatch):
+    monkeypatch.setattr("app.utils.LOCAL_CSV_PATH", str(tmp_path))
+    with open("csv_files/hired_employees.csv") as f:
+        lines = f.readlines()
+    csv_file = tmp_path / "hired_employees.csv"
+    csv_file.write_text("".join(lines[:1500]))
+
+    data = {"file": "hired_employees", "mode": "append", "chunksize": 400}
+    response = client.post("/upload_csv", query_string=data)
+    assert response.status_code == 200
+    assert response.json["rows"] == 1500
+
+    with open(csv_file, "a") as f:
+        f.write("".join(lines[1500:]))
+    response = client.post("/upload_csv", query_string=data)
+    assert response.status_code == 200
+    assert response.json["rows"] == len(lines) - 1500
+    assert response.json["byte_offset"] > 0
+    assert client.post("/upload_csv", query_string=data).json["skipped"] is True
+
+    with app.app_context():
+        # csv id 1 was already taken by the fixture employee, which is not in
+        # the summary; the skipped row is not counted either
+        assert Employee.query.count() == len(lines)
+        hired = db.session.query(db.func.sum(HireSummary.hired)).scalar()
+        assert hired == len(lines) - 1
+
+
+def test_keyed_modes_update_the_summary_with_the_changed_rows(
+    client, app, tmp_path, monkeypatch
+):
+    with app.app_context():
+        Employee.query.delete()
+        db.session.commit()
+    monkeypatch.setattr("app.utils.LOCAL_CSV_PATH", str(tmp_path))
+    with open("csv_files/hired_employees.csv") as f:
+        lines = f.readlines()
+    csv_file = tmp_path / "hired_employees.csv"
+    csv_file.write_text("".join(lines[:300]))
+    data = {"file": "hired_employees", "mode": "upsert", "chunksize": 100}
+    assert client.post("/upload_csv", query_string=data).status_code == 200
+
+    def whole_table(employee):
+        raise AssertionError("the summary must not be rebuilt from the table")
+
+    # moved to another group and to a group of its own
+    moved = ["1,Harold Vogt,2030-01-07T02:48:42Z,3,96\n"]
+    csv_file.write_text("".join(moved + lines[1:400]))
+    monkeypatch.setattr(summary, "table_hire_groups", whole_table)
+    assert client.post("/upload_csv", query_string=data).status_code == 200
+    data["mode"] = "append"
+    csv_file.write_text("".join(lines[350:500]))
+    assert client.post("/upload_csv", query_string=data).status_code == 200
+    monkeypatch.undo()
+
+    with app.app_context():
+        rows = HireSummary.query.all()
+        stored = {(r.year, r.quarter, r.department_id, r.job_id): r.hired for r in rows}
+        expected = summary.table_hire_groups(Employee.__table__)
+        assert stored == {
+            (r["year"], r["quarter"], r["department_id"], r["job_id"]): r["hired"]
+            for r in expected
+        }
+        assert stored[(2030, 1, 3, 96)] == 1
+        assert sum(stored.values()) == 500
+
+
+def test_upload_csv_keyed_modes_keep_the_sentinel_id(
+    client, app, tmp_path, monkeypatch
+):
+    monkeypatch.setattr("app.utils.LOCAL_CSV_PATH", str(tmp_path))
+    with open("csv_files/departments.csv") as f:
+        lines = f.readlines()
+    csv_file = tmp_path / "departments.csv"
+    csv_file.write_text("".join(lines))
+    data = {"file": "departments", "mode": "append"}
+    assert client.post("/upload_csv", query_string=data).status_code == 200
+
+    with open(csv_file, "a") as f:
+        f.write(f"{len(lines) + 1},Research\n")
+    response = client.post("/upload_csv", query_string=data)
+    assert response.status_code == 200
+    csv_file.write_text("".join(lines) + f"{len(lines) + 1},Research Lab\n")
+    data["mode"] = "upsert"
+    assert client.post("/upload_csv", query_string=data).status_code == 200
+
+    with app.app_context():
+        sentinel = Department.query.filter_by(name="not known").one()
+        assert sentinel.id == loaders.SENTINEL_ID
+        assert db.session.get(Department, len(lines) + 1).name == "Research Lab"
+        assert Department.query.count() == len(lines) + 2
+
+
+def test_upload_csv_keyed_modes_move_generated_sentinel(
+    client, app, tmp_path, monkeypatch
+):
+    client.post("/upload_csv", query_string={"file": "departments"})
+    with app.app_context():
+        old = Department.query.filter_by(name="not known").one()
+        old_id = old.id
+        db.session.add(Employee(name="unknown", department_id=old_id))
+        db.session.commit()
+
+    monkeypatch.setattr("app.utils.LOCAL_CSV_PATH", str(tmp_path))
+    (tmp_path / "departments.csv").write_text(f"{old_id},Research\n")
+    data = {"file": "departments", "mode": "upsert"}
+    assert client.post("/upload_csv", query_string=data).status_code == 200
+    with app.app_context():
+        assert (
+            Department.query.filter_by(name="not known").one().id == loaders.SENTINEL_ID
+        )
+        assert db.session.get(Department, old_id).name == "Research"
+        employee = Employee.query.filter_by(name="unknown").one()
+        assert employee.department_id == loaders.SENTINEL_ID
+
+
+def test_upload_csv_from_request_body(client, app):
+    with open("csv_files/departments.csv", "rb") as f:
+        departments = f.read()
+    with open("csv_files/hired_employees.csv", "rb") as f:
+        employees = f.read()
+
+    response = client.post(
+        "/upload_csv",
+        query_string={"file": "departments"},
+        data={"file": (io.BytesIO(gzip.compress(departments)), "departments.csv.gz")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 200
+    assert response.json["source"] == "body"
+    assert response.json["rows"] == 13
+
+    response = client.post(
+        "/upload_csv",
+        query_string={"file": "hired_employees", "chunksize": 500},
+        data=zstandard.ZstdCompressor().compress(employees),
+        content_type="text/csv",
+        headers={"Content-Encoding": "zstd"},
+    )
+    assert response.status_code == 200
+    assert response.json["rows"] == 1999
+    assert response.json["chunks"] == 4
+    with app.app_context():
+        assert db.session.query(Employee).count() == 2000
+
+    data = {"file": "hired_employees", "mode": "append"}
+    response = client.post(
+        "/upload_csv", query_string=data, data=employees, content_type="text/csv"
+    )
+    assert response.status_code == 400
+
+
+def test_upload_csv_request_body_limits(client, monkeypatch):
+    monkeypatch.setattr(upload_body, "UPLOAD_MAX_BYTES", 2048)
+    with open("csv_files/jobs.csv", "rb") as f:
+        jobs = f.read()
+    data = {"file": "jobs"}
+    response = client.post(
+        "/upload_csv", query_string=data, data=jobs, content_type="text/csv"
+    )
+    assert response.status_code == 413
+    # the limit applies to the decompressed csv
+    response = client.post(
+        "/upload_csv",
+        query_string=data,
+        data=gzip.compress(jobs),
+        content_type="application/gzip",
+    )
+    assert response.status_code == 413
+    response = client.post(
+        "/upload_csv",
+        query_string=data,
+        data=gzip.compress(jobs)[:200],
+        content_type="application/gzip",
+    )
+    assert response.status_code == 400
+
+
+def test_reload_tables_swaps_shadow_tables(client, app, monkeypatch):
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    client.post("/upload_csv", query_string={"file": "hired_employees"})
+    before = client.get("/generate_report2").json
+    served_during_reload = []
+    load_shadow_table = reload.load_shadow_table
+
+    def load_and_read(file_value, model, *args):
+        rows = load_shadow_table(file_value, model, *args)
+        if model == Employee:
+            response = client.get("/generate_report2", query_string={"live": 1})
+            served_during_reload.append(response.json)
+        return rows
+
+    monkeypatch.setattr(reload, "load_shadow_table", load_and_read)
+    response = client.post("/reload_tables")
+    assert response.status_code == 200
+    assert response.json["rows"] == {"department": 13, "job": 184, "employee": 1999}
+    assert served_during_reload == [before]
+
+    with app.app_context():
+        # the fixture rows were replaced by the csv rows
+        assert db.session.query(Employee).count() == 1999
+        assert db.session.query(db.func.sum(HireSummary.hired)).scalar() == 1999
+        tables = db.inspect(db.engine).get_table_names()
+        assert not [name for name in tables if name.endswith("__shadow")]
+        indexes = db.inspect(db.engine).get_indexes("employee")
+        assert "ix_employee_hire_date_department_job" in [i["name"] for i in indexes]
+    results = client.get("/run_integration_tests").json
+    assert [result["status"] for result in results] == [200, 200, 200]
+
+
+def test_reload_tables_keeps_live_tables_on_failure(client, app, monkeypatch):
+    monkeypatch.setattr(reload, "count_rows", lambda table: -1)
+    response = client.post("/reload_tables")
+    assert response.status_code == 500
+    with app.app_context():
+        assert db.session.query(Employee).count() == 1
+        tables = db.inspect(db.engine).get_table_names()
+        assert not [name for name in tables if name.endswith("__shadow")]
+
+
+def test_reload_tables_one_at_a_time_across_workers(client, app):
+    # the lock lives next to the database file, not in this process
+    with app.app_context(), reload.reload_lock() as locked:
+        assert locked
+        response = client.post("/reload_tables")
+        assert response.status_code == 409
+        with app.app_context():
+            assert db.session.query(Employee).count() == 1
+    assert client.post("/reload_tables").status_code == 200
+
+
+def test_upload_batch_loads_files_in_dependency_order(client, app):
+    manifest = {"files": ["hired_employees", "jobs", {"file": "departments"}]}
+    response = client.post("/upload_batch", json=manifest)
+    assert response.status_code == 200
+    files = response.json["files"]
+    # departments and jobs are loaded before the employees that reference them
+    assert [f["file"] for f in files] == ["jobs", "departments", "hired_employees"]
+    assert [f["rows"] for f in files] == [184, 13, 1999]
+    assert all("read_seconds" in f and "load_seconds" in f for f in files)
+
+    with app.app_context():
+        unknown_department = Department.query.filter_by(name="not known").one().id
+        unknown = Employee.query.filter_by(department_id=unknown_department).count()
+        assert unknown > 0
+        assert Employee.query.filter_by(department_id=-1).count() == 0
+
+    response = client.post("/upload_batch", json=dict(manifest, mode="replace"))
+    assert response.status_code == 200
+    with app.app_context():
+        assert db.session.query(Employee).count() == 1999
+
+    response = client.post("/upload_batch", json={"files": ["jobs", "jobs"]})
+    assert response.status_code == 400
+    response = client.post("/upload_batch", json={"files": ["jobs"], "mode": "append"})
+    assert response.status_code == 400
+
+
+def test_upload_batch_commits_all_or_nothing(client, app, monkeypatch):
+    def fail(rows):
+        raise RuntimeError("summary failed")
+
+    monkeypatch.setattr(ingest, "refresh_hire_summary", fail)
+    manifest = {"files": ["departments", "jobs", "hired_employees"]}
+    response = client.post("/upload_batch", json=manifest)
+    assert response.status_code == 500
+    with app.app_context():
+        assert db.session.query(Department).count() == 1
+        assert db.session.query(Job).count() == 1
+        assert db.session.query(Employee).count() == 1
+
+
+def wait_for_job(client, job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = client.get(f"/jobs/{job_id}")
+        if response.json["status"] in ("succeeded", "failed"):
+            return response
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_upload_csv_async_job(client, app):
+    data = {"file": "hired_employees", "async": 1, "chunksize": 500}
+    response = client.post("/upload_csv", query_string=data)
+    assert response.status_code == 202
+    job_id = response.json["job_id"]
+
+    response = wait_for_job(client, job_id)
+    assert response.status_code == 200
+    assert response.json["status"] == "succeeded"
+    assert response.json["rows_done"] == 1999
+    assert response.json["rows_total"] == 1999
+    assert response.json["result"]["chunks"] == 4
+    with app.app_context():
+        assert Employee.query.count() == 2000
+
+
+def test_upload_csv_async_job_reports_integrity_error(client):
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    response = client.post("/upload_csv", query_string={"file": "jobs", "async": 1})
+    response = wait_for_job(client, response.json["job_id"])
+    assert response.json["status"] == "failed"
+    assert "unique key contraint" in response.json["result"]["error"]
+
+
+def test_get_unknown_job(client):
+    response = client.get("/jobs/does-not-exist")
+    assert response.status_code == 404
+
+
+def test_async_job_state_saved_without_data_version(client, app):
+    with app.app_context():
+        db.session.execute(text("DROP TABLE data_version"))
+        db.session.commit()
+    data = {"file": "departments", "async": 1}
+    response = client.post("/upload_csv", query_string=data)
+    response = wait_for_job(client, response.json["job_id"], timeout=10)
+    assert response.json["status"] == "succeeded"
+    assert response.json["rows_done"] == 13
+
+
+def test_get_job_without_tables(client, app):
+    with app.app_context():
+        db.session.execute(text("DROP TABLE ingest_job"))
+        db.session.commit()
+    response = client.get("/jobs/does-not-exist")
+    assert response.status_code == 400
+    assert "create the tables" in response.json["error"]
+
+
+def test_upload_csv_async_rejects_parallel(client):
+    data = {"file": "hired_employees", "async": 1, "parallel": 2}
+    response = client.post("/upload_csv", query_string=data)
+    assert response.status_code == 400
+    assert "async" in response.json["error"]
+
+
+def test_split_byte_ranges_on_line_boundaries():
+    file_path = "csv_files/hired_employees.csv"
+    ranges = split_byte_ranges(file_path, 4)
+    with open(file_path, "rb") as f:
+        data = f.read()
+    assert len(ranges) == 4
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert data[start - 1 : start] == b"\n"
+
+
+def test_upload_csv_employees_parallel(client):
+    client.delete("/recreate_tables")
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    data = {"file": "hired_employees", "parallel": 2}
+    response = client.post("/upload_csv", query_string=data)
+    assert response.status_code == 200
+    assert response.json["engine"] == "parallel"
+    assert response.json["rows"] == 1999
+
+    response = client.get("/run_integration_tests")
+    assert [result["status"] for result in response.json] == [200, 200, 200]
+
+
+def test_run_integration_tests_reports_mismatched_ids(client, app):
+    client.delete("/recreate_tables")
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    client.post("/upload_csv", query_string={"file": "hired_employees"})
+    with app.app_context():
+        db.session.get(Employee, 10).name = "changed"
+        db.session.delete(db.session.get(Employee, 1500))
+        db.session.commit()
+
+    response = client.get("/run_integration_tests")
+    departments, jobs, employees = response.json
+    assert departments["status"] == 200
+    assert jobs["status"] == 200
+    assert departments["csv_digest"] == departments["db_digest"]
+    assert employees["status"] == 400
+    assert employees["mismatched_ids"] == [10, 1500]
+    assert employees["csv_digest"] != employees["db_digest"]
+
+
+def test_upload_csv_parallel_only_for_employees(client):
+    data = {"file": "jobs", "parallel": 2}
+    response = client.post("/upload_csv", query_string=data)
+    assert response.status_code == 400
+
+
+def test_sentinel_ids_are_cached_until_upload(client, app):
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    with app.app_context():
+        stats = reference_cache.stats()
+        assert sentinel_ids() == (14, 185)
+        assert sentinel_ids() == (14, 185)
+        assert reference_cache.stats()["misses"] == stats["misses"] + 1
+        assert reference_cache.stats()["hits"] == stats["hits"] + 1
+
+    client.delete("/recreate_tables")
+    with app.app_context():
+        assert sentinel_ids() == (-1, -1)
+
+    response = client.get("/cache_stats")
+    assert response.status_code == 200
+    assert response.json["reference_data"]["misses"] >= 2
+
+
+def test_sentinel_ids_follow_writes_of_other_processes(client, app):
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    with app.app_context():
+        assert sentinel_ids() == (14, 185)
+
+    # another worker reloads departments and bumps the shared version
+    engine = create_engine(app.config["SQLALCHEMY_DATABASE_URI"])
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE department SET id = 40 WHERE id = 14"))
+        connection.execute(text("UPDATE data_version SET version = 'other'"))
+    engine.dispose()
+    with app.app_context():
+        assert sentinel_ids() == (40, 185)
 
 
 def test_generate_report1(client):
@@ -69,11 +603,343 @@ def test_generate_report2(client):
     assert response.status_code == 200
 
 
+def test_reports_served_from_hire_summary(client, app):
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    data = {"file": "hired_employees", "chunksize": 700}
+    client.post("/upload_csv", query_string=data)
+    with app.app_context():
+        summary_total = db.session.query(db.func.sum(HireSummary.hired)).scalar()
+        assert summary_total == 1999
+
+    response = client.get("/generate_report1")
+    assert response.status_code == 200
+    assert sum(row["Q1"] + row["Q2"] + row["Q3"] + row["Q4"] for row in response.json)
+    response = client.get("/generate_report2")
+    assert response.status_code == 200
+    assert len(response.json) == 7
+
+
+def test_hire_summary_ignores_rows_of_concurrent_loads(client, app, monkeypatch):
+    with app.app_context():
+        Employee.query.delete()
+        db.session.commit()
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+
+    other = create_engine(app.config["SQLALCHEMY_DATABASE_URI"])
+    load_dataframe = ingest.load_dataframe
+
+    def load_during_other_load(model, df, engine):
+        # another load commits its rows and their summary while this one inserts
+        with other.begin() as connection:
+            connection.execute(
+                text(
+                    "INSERT INTO employee (name, department_id, job_id, hire_date) "
+                    "VALUES ('other', 1, 1, '2030-01-01 00:00:00.000000')"
+                )
+            )
+            connection.execute(
+                text("INSERT INTO hire_summary VALUES (2030, 1, 1, 1, 1)")
+            )
+        return load_dataframe(model, df, engine)
+
+    monkeypatch.setattr(ingest, "load_dataframe", load_during_other_load)
+    client.post("/upload_csv", query_string={"file": "hired_employees"})
+    other.dispose()
+    with app.app_context():
+        summary_total = db.session.query(db.func.sum(HireSummary.hired)).scalar()
+        assert summary_total == Employee.query.count() == 2000
+
+
+def test_create_tables_backfills_hire_summary(client, app):
+    response = client.post("/create_tables")
+    assert response.status_code == 200
+    with app.app_context():
+        summary = HireSummary.query.one()
+        assert (summary.year, summary.quarter, summary.hired) == (2023, 1, 1)
+
+
+def test_refresh_summary(client, app):
+    client.post("/upload_csv", query_string={"file": "hired_employees"})
+    with app.app_context():
+        db.session.query(HireSummary).delete()
+        db.session.commit()
+    response = client.post("/refresh_summary")
+    assert response.status_code == 200
+    with app.app_context():
+        summary_total = db.session.query(db.func.sum(HireSummary.hired)).scalar()
+        assert summary_total == Employee.query.count()
+
+
+@pytest.mark.parametrize("live", [0, 1])
+def test_reports_filter_by_year_department_and_job(client, live):
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    client.post("/upload_csv", query_string={"file": "hired_employees"})
+
+    response = client.get("/generate_report1", query_string={"live": live})
+    all_rows = response.json
+    response = client.get(
+        "/generate_report1", query_string={"year": 2020, "live": live}
+    )
+    assert response.json == []
+
+    data = {"department_id": 6, "live": live}
+    response = client.get("/generate_report1", query_string=data)
+    assert response.json
+    assert {row["department"] for row in response.json} == {"Engineering"}
+    assert response.json == [
+        row for row in all_rows if row["department"] == "Engineering"
+    ]
+
+    data = {"job_id": 97, "live": live}
+    response = client.get("/generate_report2", query_string=data)
+    assert response.status_code == 200
+
+
+def test_concurrent_identical_reports_share_one_query(app, monkeypatch):
+    calls = []
+
+    def slow_report1_query(**filters):
+        calls.append(filters)
+        time.sleep(0.3)
+        return report1_query(**filters)
+
+    monkeypatch.setattr(routes, "report1_query", slow_report1_query)
+    responses = []
+
+    def request_report():
+        responses.append(app.test_client().get("/generate_report1?year=2021"))
+
+    threads = [threading.Thread(target=request_report) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert [response.status_code for response in responses] == [200] * 5
+    assert len({response.get_data() for response in responses}) == 1
+
+
+def test_reports_rejected_when_all_slots_are_busy(client, monkeypatch):
+    limiter = QueryLimiter(1, 0.05)
+    monkeypatch.setattr(coalesce, "report_limiter", limiter)
+    with limiter.slot():
+        response = client.get("/generate_report2")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(coalesce.REPORT_RETRY_AFTER)
+
+    response = client.get("/generate_report2")
+    assert response.status_code == 200
+
+
+def test_live_report_uses_hire_date_index(app):
+    with app.app_context():
+        query = report1_query(2021, live=True)
+        compiled = query.compile(db.engine, compile_kwargs={"literal_binds": True})
+        plan = db.session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+    assert any("ix_employee_hire_date_department_job" in row[-1] for row in plan)
+
+
+@pytest.mark.skipif(
+    not os.getenv("TEST_POSTGRES_URL"), reason="TEST_POSTGRES_URL not configured"
+)
+def test_live_report_uses_hire_date_index_on_postgres():
+    engine = create_engine(os.environ["TEST_POSTGRES_URL"])
+    db.metadata.create_all(engine)
+    query = report1_query(2021, department_id=6, live=True)
+    compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.begin() as connection:
+        connection.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = connection.execute(text(f"EXPLAIN {compiled}")).scalars().all()
+    assert any("ix_employee_department_hire_date" in line for line in plan)
+
+
+def test_report_etag_and_conditional_get(client):
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    client.post("/upload_csv", query_string={"file": "hired_employees"})
+
+    response = client.get("/generate_report2")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert not etag.startswith("W/")
+
+    response = client.get("/generate_report2", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    response = client.get(
+        "/generate_report2",
+        query_string={"year": 2020},
+        headers={"If-None-Match": etag},
+    )
+    assert response.status_code == 200
+    assert response.json == []
+
+
+def test_report_cache_invalidated_by_writes(client):
+    response = client.get("/generate_report1")
+    assert response.json == []
+    etag = response.headers["ETag"]
+
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    client.post("/upload_csv", query_string={"file": "hired_employees"})
+
+    response = client.get("/generate_report1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json
+    assert response.headers["ETag"] != etag
+
+    client.delete("/recreate_tables")
+    response = client.get("/generate_report1")
+    assert response.json == []
+
+
+def test_report_cache_sees_writes_of_other_processes(client, app):
+    assert client.get("/generate_report1", query_string={"live": 1}).json == []
+
+    # another worker loads a row and bumps the version this process never touched
+    engine = create_engine(app.config["SQLALCHEMY_DATABASE_URI"])
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO employee (name, department_id, job_id, hire_date) "
+                "VALUES ('other', 1, 1, '2021-02-01 00:00:00.000000')"
+            )
+        )
+        connection.execute(text("INSERT INTO data_version VALUES (1, 'other')"))
+    engine.dispose()
+
+    response = client.get("/generate_report1", query_string={"live": 1})
+    assert [row["Q1"] for row in response.json] == [1]
+
+
+def test_cache_decorators_without_data_version_table(client, app):
+    with app.app_context():
+        db.session.execute(text("DROP TABLE data_version"))
+        db.session.commit()
+
+    response = client.get("/generate_report1")
+    assert response.status_code == 200
+    assert response.json == []
+    response = client.post("/upload_csv", query_string={"file": "bogus"})
+    assert response.status_code == 400
+    assert "error" in response.json
+    response = client.post("/upload_csv", query_string={"file": "departments"})
+    assert response.status_code == 200
+    assert response.json["rows"] == 13
+    response = client.get("/export/department")
+    assert response.status_code == 200
+    assert response.get_data()
+
+
+def test_validation_errors_keep_the_data_version(client, app):
+    client.post("/upload_csv", query_string={"file": "departments"})
+    with app.app_context():
+        version = cache.response_cache.data_version()
+    assert client.post("/upload_csv", query_string={"file": "bogus"}).status_code == 400
+    with app.app_context():
+        assert cache.response_cache.data_version() == version
+        # the missing row is inserted once, whoever bumps first
+        db.session.execute(text("DELETE FROM data_version"))
+        db.session.commit()
+        cache.response_cache.bump_version()
+        cache.response_cache.bump_version()
+        assert (
+            db.session.execute(text("SELECT COUNT(*) FROM data_version")).scalar() == 1
+        )
+
+
+def test_reports_stream_ndjson_csv_and_json(client):
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    client.post("/upload_csv", query_string={"file": "hired_employees"})
+    expected = client.get("/generate_report1").json
+
+    response = client.get("/generate_report1", query_string={"format": "ndjson"})
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == expected
+
+    response = client.get("/generate_report1", query_string={"format": "json"})
+    assert json.loads(response.get_data(as_text=True)) == expected
+
+    response = client.get("/generate_report2", query_string={"format": "csv"})
+    assert response.mimetype == "text/csv"
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == ["id", "deparment", "hired"]
+    assert len(rows) == len(client.get("/generate_report2").json) + 1
+
+
+def test_reports_reject_unknown_format(client):
+    response = client.get("/generate_report1", query_string={"format": "xml"})
+    assert response.status_code == 400
+
+
+def test_run_null_report(client):
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    client.post("/upload_csv", query_string={"file": "hired_employees"})
+    response = client.get("/run_null_report")
+    assert response.status_code == 200
+    department, job, employees = response.json
+    assert department == {
+        "message": '[{"id":14,"name":"not known"}]',
+        "table": "Department",
+    }
+    assert job == {"message": '[{"id":185,"title":"not known"}]', "table": "Job"}
+    assert employees == {
+        "count_nulls_job_id": "valor por defecto en la BD:185.0  conteo: 16",
+        "count_nulls_department_id": "valor por defecto en la BD: 14.0 conteo: 21",
+        "nan_count_name": 19,
+        "nan_hire_date": "valor por defecto en BD 1970-01-01 00:00:00 conteo: 16",
+        "table": "Employees",
+    }
+
+
 def test_create_tables(client):
     response = client.post("/create_tables")
     assert response.status_code == 200
 
 
+def test_metrics_endpoint(client):
+    client.post("/upload_csv", query_string={"file": "departments"})
+    data = {"file": "hired_employees", "chunksize": 500}
+    client.post("/upload_csv", query_string=data)
+    client.get("/generate_report1")
+    client.get("/generate_report1")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    # the registry is per process, so only the series are checked
+    assert (
+        'csv_api_request_duration_seconds_count{endpoint="/upload_csv",'
+        'method="POST",status="200"}'
+    ) in body
+    for phase in ("read", "transform", "insert", "commit"):
+        assert f'csv_api_upload_phase_seconds_count{{phase="{phase}"}}' in body
+    assert 'csv_api_upload_rows_total{table="employee"}' in body
+    assert 'csv_api_sql_statement_seconds_count{statement="INSERT"}' in body
+    assert 'csv_api_cache_hits_total{cache="responses"}' in body
+
+
+def test_server_timing_header(client, monkeypatch):
+    monkeypatch.setattr("app.metrics.SERVER_TIMING", True)
+    data = {"file": "hired_employees", "chunksize": 500}
+    response = client.post("/upload_csv", query_string=data)
+    timing = response.headers["Server-Timing"]
+    for name in ("read", "transform", "insert", "commit", "sql", "total"):
+        assert f"{name};dur=" in timing
+
+
 @mock_aws
 def test_upload_csv_departments_from_s3(client):
     s3 = boto3.client("s3", region_name="us-east-1")
@@ -85,7 +951,7 @@ def test_upload_csv_departments_from_s3(client):
     data = {"file": "departments", "source": "s3"}
     response = client.post("/upload_csv", query_string=data)
     assert response.status_code == 200
-    assert response.json == {"message": "File departments uploaded successfully"}
+    assert response.json["message"] == "File departments uploaded successfully"
 
 
 @mock_aws
@@ -97,7 +963,7 @@ def test_upload_csv_jobs_from_s3(client):
     data = {"file": "jobs", "source": "s3"}
     response = client.post("/upload_csv", query_string=data)
     assert response.status_code == 200
-    assert response.json == {"message": "File jobs uploaded successfully"}
+    assert response.json["message"] == "File jobs uploaded successfully"
 
 
 @mock_aws
@@ -111,4 +977,222 @@ def test_upload_csv_hired_employees_from_s3(client):
     data = {"file": "hired_employees", "source": "s3"}
     response = client.post("/upload_csv", query_string=data)
     assert response.status_code == 200
-    assert response.json == {"message": "File hired_employees uploaded successfully"}
+    assert response.json["message"] == "File hired_employees uploaded successfully"
+
+
+def test_fetch_object_ranged_reads_and_lru_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.fetch.S3_RANGE_SIZE", 1000)
+    bucket_dir = tmp_path / "bucket" / "csv_files"
+    bucket_dir.mkdir(parents=True)
+    for name in ("jobs", "hired_employees"):
+        with open(f"csv_files/{name}.csv", "rb") as f:
+            (bucket_dir / f"{name}.csv").write_bytes(f.read())
+    bucket = LocalBucket(str(tmp_path / "bucket"))
+    size = os.path.getsize("csv_files/hired_employees.csv")
+    cache = FileCache(str(tmp_path / "cache"), max_bytes=size + 100)
+
+    path = fetch_object(bucket, "csv_files/hired_employees.csv", cache)
+    with open(path, "rb") as cached, open("csv_files/hired_employees.csv", "rb") as f:
+        assert cached.read() == f.read()
+    assert fetch_object(bucket, "csv_files/hired_employees.csv", cache) == path
+    assert cache.stats()["hits"] == 1
+
+    # the least recently used object is evicted once the cache is full
+    fetch_object(bucket, "csv_files/jobs.csv", cache)
+    assert cache.stats()["evictions"] == 1
+    assert not os.path.exists(path)
+
+
+def test_fetch_object_restarts_when_overwritten_during_download(tmp_path):
+    bucket_dir = tmp_path / "bucket" / "csv_files"
+    bucket_dir.mkdir(parents=True)
+    csv_file = bucket_dir / "jobs.csv"
+    csv_file.write_bytes(b"1,old title\n")
+    cache = FileCache(str(tmp_path / "cache"), max_bytes=1 << 20)
+
+    class OverwrittenBucket(LocalBucket):
+        def get_range(self, key, start, end, etag):
+            if csv_file.read_bytes().startswith(b"1,old"):
+                csv_file.write_bytes(b"1,new title\n2,other\n")
+            return super().get_range(key, start, end, etag)
+
+    path = fetch_object(
+        OverwrittenBucket(str(tmp_path / "bucket")), "csv_files/jobs.csv", cache
+    )
+    with open(path, "rb") as f:
+        assert f.read() == b"1,new title\n2,other\n"
+    assert os.listdir(tmp_path / "cache") == [os.path.basename(path)]
+
+
+@mock_aws
+def test_s3_ranges_only_read_the_headed_version():
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="csv-api-versions")
+    s3.put_object(Bucket="csv-api-versions", Key="jobs.csv", Body=b"1,old\n")
+    bucket = S3Bucket("csv-api-versions")
+    etag, size = bucket.head("jobs.csv")
+    assert bucket.get_range("jobs.csv", 0, size, etag) == b"1,old\n"
+
+    s3.put_object(Bucket="csv-api-versions", Key="jobs.csv", Body=b"1,new\n")
+    with pytest.raises(ObjectChanged):
+        bucket.get_range("jobs.csv", 0, size, etag)
+    # the client is built once per bucket
+    assert get_bucket("csv-api-versions") is get_bucket("csv-api-versions")
+
+
+@mock_aws
+def test_s3_client_built_once_by_concurrent_first_calls(monkeypatch):
+    class SlowBucket(S3Bucket):
+        def __init__(self, name):
+            time.sleep(0.05)
+            super().__init__(name)
+
+    monkeypatch.setattr(fetch, "S3Bucket", SlowBucket)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        buckets = list(pool.map(get_bucket, ["csv-api-threads"] * 8))
+    assert len({id(bucket) for bucket in buckets}) == 1
+
+
+@mock_aws
+def test_run_integration_tests_from_s3_reads_cached_files(client):
+    s3 = boto3.client("s3", region_name="us-east-1")
+    bucket_name = "csv-api-employee-db"
+    s3.create_bucket(Bucket=bucket_name)
+    for name in ("departments", "jobs", "hired_employees"):
+        s3.upload_file(f"csv_files/{name}.csv", bucket_name, f"csv_files/{name}.csv")
+        data = {"file": name, "source": "s3"}
+        assert client.post("/upload_csv", query_string=data).status_code == 200
+
+    before = client.get("/cache_stats").json["s3_files"]
+    response = client.get("/run_integration_tests", query_string={"source": "s3"})
+    assert response.status_code == 200
+    after = client.get("/cache_stats").json["s3_files"]
+    assert after["hits"] - before["hits"] == 3
+    assert after["misses"] == before["misses"]
+
+
+def test_read_only_endpoints_use_replica(client, app, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "REPLICA_CACHE_TTL", 0.5)
+    replica_url = f"sqlite:///{tmp_path / 'replica.db'}"
+    replica = create_engine(replica_url)
+    db.metadata.create_all(replica)
+    app.config["SQLALCHEMY_REPLICA_URLS"] = [replica_url]
+
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    response = client.post("/upload_csv", query_string={"file": "hired_employees"})
+    assert response.status_code == 200
+    with replica.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM employee")).scalar() == 0
+
+    # the replica has the schema but none of the rows written to the primary
+    response = client.get("/generate_report1")
+    assert response.status_code == 200
+    assert response.json == []
+    assert 'csv_api_replica_requests_total{target="' in client.get("/metrics").get_data(
+        as_text=True
+    )
+
+    # once the replica catches up the lagging response expires from the cache
+    with replica.begin() as connection:
+        connection.execute(text("INSERT INTO department VALUES (1, 'd')"))
+        connection.execute(text("INSERT INTO job VALUES (1, 'j')"))
+        connection.execute(text("INSERT INTO hire_summary VALUES (2021, 1, 1, 1, 1)"))
+    assert client.get("/generate_report1").json == []
+    time.sleep(0.6)
+    assert [row["Q1"] for row in client.get("/generate_report1").json] == [1]
+
+
+def test_read_only_endpoints_fall_back_to_primary(client, app):
+    app.config["SQLALCHEMY_REPLICA_URLS"] = ["sqlite:////nonexistent_dir/replica.db"]
+    client.post("/upload_csv", query_string={"file": "departments"})
+    client.post("/upload_csv", query_string={"file": "jobs"})
+    client.post("/upload_csv", query_string={"file": "hired_employees"})
+
+    response = client.get("/generate_report1")
+    assert response.status_code == 200
+    assert response.json
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'csv_api_replica_requests_total{target="primary"}' in body
+
+
+def test_export_employee_parquet_and_arrow(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(export, "EXPORT_SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setattr(export, "EXPORT_BATCH_SIZE", 300)
+    client.post("/upload_csv", query_string={"file": "hired_employees"})
+
+    response = client.get("/export/employee")
+    assert response.status_code == 200
+    assert response.is_streamed
+    table = pq.read_table(io.BytesIO(response.get_data()))
+    assert table.num_rows == 2000
+    assert table.column_names == ["id", "name", "job_id", "department_id", "hire_date"]
+    assert pq.ParquetFile(io.BytesIO(response.get_data())).num_row_groups > 1
+
+    query = {
+        "format": "arrow",
+        "columns": "id,hire_date",
+        "hire_date_from": "2021-01-01",
+        "hire_date_to": "2022-01-01",
+    }
+    response = client.get("/export/employee", query_string=query)
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(response.get_data()).read_all()
+    assert table.column_names == ["id", "hire_date"]
+    assert 0 < table.num_rows < 2000
+    assert pa.compute.min(table["hire_date"]).as_py() >= datetime(2021, 1, 1)
+
+    response = client.get("/export/employee", query_string={"columns": "salary"})
+    assert response.status_code == 400
+    response = client.get("/export/salaries")
+    assert response.status_code == 400
+
+
+def test_export_snapshot_invalidated_by_upload(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(export, "EXPORT_SNAPSHOT_DIR", str(tmp_path))
+    first = client.get("/export/department")
+    assert pq.read_table(io.BytesIO(first.get_data())).num_rows == 1
+    assert len(os.listdir(tmp_path)) == 1
+
+    cached = client.get("/export/department")
+    # snapshots are sent as files with a known length
+    assert cached.content_length == len(first.get_data())
+    assert cached.get_data() == first.get_data()
+    cached.close()
+
+    client.post("/upload_csv", query_string={"file": "departments"})
+    response = client.get("/export/department")
+    assert response.content_length is None
+    assert pq.read_table(io.BytesIO(response.get_data())).num_rows == 14
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_export_snapshots_shared_by_processes(client, app, monkeypatch, tmp_path):
+    monkeypatch.setattr(export, "EXPORT_SNAPSHOT_DIR", str(tmp_path))
+    client.get("/export/job").get_data()
+    (job_snapshot,) = os.listdir(tmp_path)
+    client.get("/export/department").get_data()
+    assert len(os.listdir(tmp_path)) == 2
+
+    # another process loads a department and bumps the shared data version
+    engine = create_engine(app.config["SQLALCHEMY_DATABASE_URI"])
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO department (name) VALUES ('other')"))
+        connection.execute(text("INSERT INTO data_version VALUES (1, 'other')"))
+    engine.dispose()
+
+    response = client.get("/export/department")
+    assert response.content_length is None
+    assert pq.read_table(io.BytesIO(response.get_data())).num_rows == 2
+    # only the older version of the same export is removed
+    assert len(os.listdir(tmp_path)) == 2
+    assert job_snapshot in os.listdir(tmp_path)
+
+
+def test_startup_imports_stay_light():
+    # best of three fresh interpreters, the first one can pay for a cold disk cache
+    profile = min(
+        (import_profile() for _ in range(3)), key=lambda profile: profile["seconds"]
+    )
+    assert [name for name in HEAVY_MODULES if name in profile["modules"]] == []
+    assert profile["seconds"] < STARTUP_TARGET_SECONDS